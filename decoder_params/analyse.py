@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+summaries over everything in a results store, grouped by decoder params:
+
+    ./analyse.py ingest haiku.json eclipses.json --store results
+    ./analyse.py summary --store results --group-by prompt temperature top_k
+
+latency/throughput columns get p50/p95, and each group also gets two output
+diversity numbers: the share of distinct outputs, and distinct-2 (unique word
+bigrams over all bigrams) which still moves when outputs differ only slightly
+"""
+import argparse
+from collections import defaultdict
+import hashlib
+import math
+from typing import Dict, List, Sequence, Tuple
+
+from results_store import ResultsStore, ingest_files
+from stats import percentile
+
+DEFAULT_GROUP_BY = ["temperature", "top_p", "top_k"]
+DEFAULT_METRICS = ["latency_ms", "first_token_latency_ms", "output_tokens_per_second"]
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+
+class Diversity:
+    """
+    keeps hashes rather than the outputs themselves, so memory grows with the
+    number of distinct outputs, not the number of runs
+    """
+    __slots__ = ("runs", "outputs", "bigrams", "bigram_total")
+
+    def __init__(self):
+        self.runs = 0
+        self.outputs = set()
+        self.bigrams = set()
+        self.bigram_total = 0
+
+    def add(self, output: str) -> None:
+        self.runs += 1
+        self.outputs.add(_digest(output))
+        words = output.lower().split()
+        for pair in zip(words, words[1:]):
+            self.bigrams.add(_digest(" ".join(pair)))
+            self.bigram_total += 1
+
+    @property
+    def distinct_outputs(self) -> float:
+        return len(self.outputs) / self.runs if self.runs else math.nan
+
+    @property
+    def distinct_2(self) -> float:
+        return len(self.bigrams) / self.bigram_total if self.bigram_total else math.nan
+
+
+def _group_value(value):
+    # NaN never equals itself, so missing numeric values would each get a group of their own
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _sort_value(value) -> Tuple:
+    # numbers in numeric order (top_k 5 before 40), then text, then missing values
+    if value is None:
+        return (2, "")
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+def summarise(store: ResultsStore, group_by: Sequence[str], metrics: Sequence[str]) -> List[Dict]:
+    cols = store.columns(list(group_by) + list(metrics) + ["output"])
+    groups: Dict[Tuple, List[int]] = defaultdict(list)
+    for i in range(len(cols)):
+        groups[tuple(_group_value(cols[g][i]) for g in group_by)].append(i)
+
+    summary = []
+    for key in sorted(groups, key=lambda k: [_sort_value(v) for v in k]):
+        rows = groups[key]
+        entry: Dict = dict(zip(group_by, key))
+        entry["n"] = len(rows)
+        for m in metrics:
+            values = [cols[m][i] for i in rows if not math.isnan(cols[m][i])]
+            entry[f"{m}_p50"] = percentile(values, 50) if values else math.nan
+            entry[f"{m}_p95"] = percentile(values, 95) if values else math.nan
+        diversity = Diversity()
+        for i in rows:
+            if cols["output"][i] is not None:
+                diversity.add(cols["output"][i])
+        entry["distinct_outputs"] = diversity.distinct_outputs
+        entry["distinct_2"] = diversity.distinct_2
+        summary.append(entry)
+    return summary
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "-"
+        return str(int(value)) if value.is_integer() else f"{value:.2f}"
+    text = str(value)
+    return text if len(text) <= 40 else text[:37] + "..."
+
+
+def print_table(summary: List[Dict]) -> None:
+    if not summary:
+        print("no results")
+        return
+    headers = list(summary[0])
+    rows = [[_fmt(entry[h]) for h in headers] for entry in summary]
+    widths = [max(len(h), *(len(r[i]) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for r in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="copy existing per-run json files into the store")
+    ingest.add_argument("files", nargs="+")
+    ingest.add_argument("--store", type=str, default="results")
+
+    summary = sub.add_parser("summary", help="percentiles and diversity per parameter group")
+    summary.add_argument("--store", type=str, default="results")
+    summary.add_argument("--group-by", nargs="+", default=DEFAULT_GROUP_BY)
+    summary.add_argument("--metrics", nargs="+", default=DEFAULT_METRICS)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "ingest":
+        print(f"ingested {ingest_files(store, args.files)} reports into {args.store}")
+    else:
+        print_table(summarise(store, args.group_by, args.metrics))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+batched generation.  `run_pixi_generate` only ever sends one prompt, so the
+`--max-batch-size` it passes is never actually used.  here a list of prompts,
+each with its own decoder params, is kept up to `max_batch_size` requests in
+flight against a running server, which batches whatever is in flight together.
+
+`max generate` only takes one prompt per invocation, so there is no real
+batching for the pixi backend - it runs the prompts one at a time, and is only
+there to give a baseline to compare against.
+
+    ./batch.py --prompts-file prompts.txt --batch-sizes 1 2 4 8 --backend server
+
+prints how aggregate throughput scales with batch size.  launch the server with
+a `--max-batch-size` at least as large as the biggest one tested
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import time
+from typing import List, Optional, Sequence
+
+from modelreport import ModelReport
+from decoding import DecoderParams
+from inference_tests import run_pixi_generate
+from server_backend import DEFAULT_SERVER_URL, ServerClient, run_server_generate
+
+
+@dataclass(frozen=True)
+class BatchRequest:
+    prompt: str
+    params: DecoderParams = DecoderParams()
+
+
+@dataclass()
+class BatchReport:
+    reports: List[ModelReport] = field(default_factory=list)
+    max_batch_size: Optional[int] = None
+    wall_ms: Optional[float] = None
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(r.output_size or 0 for r in self.reports)
+
+    @property
+    def output_tokens_per_second(self) -> Optional[float]:
+        if not self.wall_ms:
+            return None
+        return self.output_tokens / (self.wall_ms / 1000)
+
+    @property
+    def requests_per_second(self) -> Optional[float]:
+        if not self.wall_ms:
+            return None
+        return len(self.reports) / (self.wall_ms / 1000)
+
+
+def run_batch(
+    requests: Sequence[BatchRequest],
+    max_batch_size: int = 1,
+    backend: str = "server",
+    client: Optional[ServerClient] = None,
+    use_cache: bool = False,
+) -> BatchReport:
+    """
+    returns one report per request, in request order.  the cache is off by
+    default since the point is usually to measure the engine
+    """
+    result = BatchReport(max_batch_size=max_batch_size)
+    start = time.perf_counter()
+
+    if backend == "server":
+        owns_client = client is None
+        if client is None:
+            client = ServerClient(pool_size=max_batch_size)
+
+        def one(req: BatchRequest) -> ModelReport:
+            params = req.params.with_overrides(max_batch_size=max_batch_size)
+            return run_server_generate(req.prompt, client=client, use_cache=use_cache, **params.__dict__)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_batch_size) as pool:
+                result.reports = list(pool.map(one, requests))
+        finally:
+            if owns_client:
+                client.close()
+    else:
+        for req in requests:
+            params = req.params.with_overrides(max_batch_size=max_batch_size)
+            result.reports.append(run_pixi_generate(req.prompt, use_cache=use_cache, **params.__dict__))
+
+    result.wall_ms = (time.perf_counter() - start) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompts-file", type=str, required=True, help="one prompt per line")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=1, help="send the prompt list this many times")
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--top-p", type=float)
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=["pixi", "server"], default="server")
+    parser.add_argument("--server-url", type=str, default=DEFAULT_SERVER_URL)
+    args = parser.parse_args()
+
+    with open(args.prompts_file) as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    params = DecoderParams(temperature=args.temperature, top_p=args.top_p, top_k=args.top_k, seed=args.seed)
+    requests = [BatchRequest(p, params) for p in prompts] * args.repeat
+
+    print(f"{'batch':>6}{'requests':>10}{'wall_ms':>12}{'req/s':>10}{'out tok/s':>12}")
+    with ServerClient(args.server_url, pool_size=max(args.batch_sizes)) as client:
+        for size in args.batch_sizes:
+            batch = run_batch(requests, max_batch_size=size, backend=args.backend, client=client)
+            print(
+                f"{size:>6}{len(batch.reports):>10}{batch.wall_ms:>12.0f}"
+                f"{batch.requests_per_second:>10.2f}{batch.output_tokens_per_second:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
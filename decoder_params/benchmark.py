@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+repeatable latency/throughput numbers for one configuration.  a single run is
+at the mercy of whatever else the GPU was doing, so this does a few warmup runs
+(discarded), then `--reps` measured ones, and reports mean/p50/p95/p99 with
+bootstrap confidence intervals:
+
+    ./benchmark.py --backend server --reps 30 --save-baseline base.json
+    # ...change something...
+    ./benchmark.py --backend server --reps 30 --compare base.json
+
+`--compare` runs a Mann-Whitney U test per metric and flags a regression when
+the difference is significant *and* the median moved the wrong way by more
+than `--min-change`.  the cache is always bypassed
+"""
+import argparse
+import json
+from typing import Callable, Dict, List, Optional
+
+from modelreport import ModelReport
+from decoding import DecoderParams
+from inference_tests import run_pixi_generate
+from server_backend import DEFAULT_SERVER_URL, ServerClient, run_server_generate
+from stats import bootstrap_ci, mann_whitney_u, mean, percentile
+
+# metric name -> True when bigger is better
+METRICS = {
+    "ttft_ms": False,
+    "latency_ms": False,
+    "tokens_per_s": True,
+}
+
+
+def extract_metrics(report: ModelReport) -> Dict[str, Optional[float]]:
+    return {
+        # MAX prints its own TTFT for pixi runs, server runs only have ours
+        "ttft_ms": report.first_token_latency_ms if report.first_token_latency_ms is not None else report.client_first_token_ms,
+        "latency_ms": report.latency_ms,
+        "tokens_per_s": report.output_tokens_per_second,
+    }
+
+
+def run_benchmark(
+    generate: Callable[[], ModelReport],
+    warmup: int = 2,
+    reps: int = 20,
+) -> Dict[str, List[float]]:
+    for i in range(warmup):
+        generate()
+        print(f"warmup {i + 1}/{warmup}")
+
+    samples: Dict[str, List[float]] = {m: [] for m in METRICS}
+    for i in range(reps):
+        report = generate()
+        for m, value in extract_metrics(report).items():
+            if value is not None:
+                samples[m].append(value)
+        print(f"rep {i + 1}/{reps}\tlatency {report.latency_ms}")
+    return samples
+
+
+def describe(values: List[float], confidence: float = 0.95) -> Dict[str, float]:
+    summary: Dict[str, float] = {"n": len(values)}
+    for name, stat in (
+        ("mean", mean),
+        ("p50", lambda v: percentile(v, 50)),
+        ("p95", lambda v: percentile(v, 95)),
+        ("p99", lambda v: percentile(v, 99)),
+    ):
+        lo, hi = bootstrap_ci(values, stat, confidence)
+        summary[name] = stat(values)
+        summary[f"{name}_lo"] = lo
+        summary[f"{name}_hi"] = hi
+    return summary
+
+
+def compare(
+    baseline: Dict[str, List[float]],
+    current: Dict[str, List[float]],
+    alpha: float = 0.05,
+    min_change: float = 0.05,
+) -> List[Dict]:
+    """
+    one entry per metric present in both runs.  `regression` is only set when
+    the change is both statistically significant and large enough to care about
+    """
+    results = []
+    for m, higher_is_better in METRICS.items():
+        a, b = baseline.get(m) or [], current.get(m) or []
+        if not a or not b:
+            continue
+        base_median = percentile(a, 50)
+        change = (percentile(b, 50) - base_median) / base_median if base_median else 0.0
+        p_value = mann_whitney_u(a, b)
+        worse = change < -min_change if higher_is_better else change > min_change
+        results.append({
+            "metric": m,
+            "baseline_p50": base_median,
+            "current_p50": percentile(b, 50),
+            "change": change,
+            "p_value": p_value,
+            "regression": p_value < alpha and worse,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prompt", type=str, default="what is the capital of France?")
+    parser.add_argument("--max-batch-size", type=int, default=1)
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--top-p", type=float)
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=["pixi", "server"], default="pixi")
+    parser.add_argument("--server-url", type=str, default=DEFAULT_SERVER_URL)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--reps", type=int, default=20)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--save-baseline", type=str, help="write the raw samples here")
+    parser.add_argument("--compare", type=str, help="baseline file to test for regressions against")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--min-change", type=float, default=0.05, help="smallest relative change worth flagging")
+    args = parser.parse_args()
+
+    params = DecoderParams(
+        max_batch_size=args.max_batch_size,
+        temperature=args.temperature,
+        top_p=args.top_p,
+        top_k=args.top_k,
+        seed=args.seed,
+    )
+    config = {"prompt": args.prompt, "backend": args.backend, **params.__dict__}
+
+    client: Optional[ServerClient] = None
+    if args.backend == "server":
+        client = ServerClient(args.server_url, pool_size=1)
+        generate = lambda: run_server_generate(
+            args.prompt, client=client, use_cache=False, stream=True, **params.__dict__
+        )
+    else:
+        generate = lambda: run_pixi_generate(args.prompt, use_cache=False, **params.__dict__)
+
+    try:
+        samples = run_benchmark(generate, warmup=args.warmup, reps=args.reps)
+    finally:
+        if client is not None:
+            client.close()
+
+    print(f"\n{'metric':<14}{'n':>4}{'mean':>24}{'p50':>24}{'p95':>24}{'p99':>24}")
+    for m, values in samples.items():
+        if not values:
+            continue
+        d = describe(values, args.confidence)
+        cells = "".join(
+            f"{d[s]:>10.2f} [{d[s + '_lo']:.1f}, {d[s + '_hi']:.1f}]".rjust(24)
+            for s in ("mean", "p50", "p95", "p99")
+        )
+        print(f"{m:<14}{d['n']:>4}{cells}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "samples": samples}, f, indent=2)
+        print(f"\nbaseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"\nwarning: baseline was taken with a different config: {baseline.get('config')}")
+        print()
+        regressed = False
+        for r in compare(baseline["samples"], samples, args.alpha, args.min_change):
+            flag = "REGRESSION" if r["regression"] else "ok"
+            print(
+                f"{r['metric']:<14}{r['baseline_p50']:>10.2f} -> {r['current_p50']:<10.2f}"
+                f"{r['change'] * 100:+7.1f}%  p={r['p_value']:.4f}  {flag}"
+            )
+            regressed = regressed or r["regression"]
+        if regressed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
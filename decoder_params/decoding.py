@@ -0,0 +1,104 @@
+from dataclasses import dataclass, replace
+import os
+from typing import Dict, List, Optional
+
+from modelreport import ModelReport
+
+MODEL_ID = "google/gemma-3-4B-it"
+CUSTOM_ARCHITECTURES = "gemma3multimodal"
+MAX_LENGTH = 5000
+MAX_NEW_TOKENS = 256
+
+
+def prompt_template(prompt: str) -> str:
+    """
+    wraps a user prompt in gemma's turn markers, exactly as it is sent to the model
+    """
+    return f"<start_of_turn>{prompt}<end_of_turn>\n"
+
+
+def debug_mode() -> bool:
+    return os.environ.get("DEBUG_MODE", "0").lower() in ("1", "true")
+
+
+@dataclass(frozen=True)
+class DecoderParams:
+    """
+    the knobs we turn between runs.  shared by every backend so that a pixi run
+    and a server run with the same params are actually comparable
+    """
+    max_batch_size: Optional[int] = 1
+    temperature: Optional[float] = 0.2
+    top_p: Optional[float] = 0.9
+    top_k: Optional[int] = 50
+    seed: Optional[int] = 42
+
+    def __post_init__(self):
+        # json specs happily give us `0` for a temperature, keep types consistent
+        # so equal params always compare (and hash, and serialise) equally
+        for name, kind in (("temperature", float), ("top_p", float), ("top_k", int), ("seed", int), ("max_batch_size", int)):
+            value = getattr(self, name)
+            if value is not None:
+                object.__setattr__(self, name, kind(value))
+
+    def resolve(self) -> "DecoderParams":
+        """
+        DEBUG_MODE forces fully greedy decoding regardless of what was asked for
+        """
+        if debug_mode():
+            return DecoderParams(
+                max_batch_size=None,
+                temperature=0.0,
+                top_p=1.0,
+                top_k=1,
+                seed=42,
+            )
+        return self
+
+    @property
+    def is_deterministic(self) -> bool:
+        """
+        greedy decoding gives the same output for the same prompt every time
+        """
+        return self.temperature == 0 or self.top_k == 1
+
+    def with_overrides(self, **kwargs) -> "DecoderParams":
+        return replace(self, **kwargs)
+
+    def as_cli_args(self) -> List[str]:
+        args: List[str] = []
+        if self.max_batch_size is not None:
+            args += ["--max-batch-size", str(self.max_batch_size)]
+        if self.temperature is not None:
+            args += ["--temperature", str(self.temperature)]
+        if self.top_p is not None:
+            args += ["--top-p", str(self.top_p)]
+        if self.top_k is not None:
+            args += ["--top-k", str(self.top_k)]
+        if self.seed is not None:
+            args += ["--seed", str(self.seed)]
+        return args
+
+    def as_request_fields(self) -> Dict:
+        """
+        sampling fields for an OpenAI-compatible request body.  `top_k` is not in
+        the OpenAI spec but MAX (and vLLM) accept it as an extension
+        """
+        fields = {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "top_k": self.top_k,
+            "seed": self.seed,
+        }
+        return {k: v for k, v in fields.items() if v is not None}
+
+    def apply_to(self, report: ModelReport) -> None:
+        """
+        records the params on the report.  debug runs historically leave these
+        blank, so callers only do this for non-debug runs
+        """
+        report.max_batch_size = self.max_batch_size
+        report.temperature = self.temperature
+        report.top_p = self.top_p
+        report.top_k = self.top_k
+        report.seed = self.seed
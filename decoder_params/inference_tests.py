@@ -1,9 +1,21 @@
 #!/usr/bin/env python3
 import argparse
-import os
 import subprocess
 from typing import Optional
 from modelreport import ModelReport
+from decoding import (
+    CUSTOM_ARCHITECTURES,
+    MAX_LENGTH,
+    MAX_NEW_TOKENS,
+    MODEL_ID,
+    DecoderParams,
+    debug_mode,
+    prompt_template,
+)
+from result_cache import cache_key, default_cache
+from results_store import ResultsStore
+from streaming import ArrivalTimer, stream_process
+from server_backend import DEFAULT_SERVER_URL, ServerClient, run_server_generate
 
 
 def run_pixi_generate(
@@ -14,6 +26,8 @@ def run_pixi_generate(
     top_p: Optional[float] = 0.9,
     top_k: Optional[int] = 50,
     seed: int = 42,
+    use_cache: bool = True,
+    stream: bool = False,
 ) -> ModelReport:
     report = ModelReport()
     report.prompt = prompt
@@ -21,51 +35,57 @@ def run_pixi_generate(
     cmd = [
         "pixi", "r",
         "max", "generate",
-        "--model", "google/gemma-3-4B-it",
-        "--custom-architectures", "gemma3multimodal",
-        "--max-length", "5000",
-        "--max-new-tokens", "256",
-        "--prompt", f"<start_of_turn>{prompt}<end_of_turn>\n",
+        "--model", MODEL_ID,
+        "--custom-architectures", CUSTOM_ARCHITECTURES,
+        "--max-length", str(MAX_LENGTH),
+        "--max-new-tokens", str(MAX_NEW_TOKENS),
+        "--prompt", prompt_template(prompt),
     ]
 
-    debug = os.environ.get("DEBUG_MODE", "0").lower() in ("1", "true")
+    params = DecoderParams(
+        max_batch_size=max_batch_size,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        seed=seed,
+    )
+    resolved = params.resolve()
+    cmd += resolved.as_cli_args()
+    if not debug_mode():
+        params.apply_to(report)
+
+    # deterministic runs always give the same answer, so reuse it if we have it
+    cache = default_cache() if use_cache else None
+    key = None
+    if cache is not None and resolved.is_deterministic:
+        key = cache_key(prompt, resolved, backend="pixi")
+        # a streaming run is after fresh timings, so it may refresh the cache but never reads it
+        hit = None if stream else cache.get(key)
+        if hit is not None:
+            if out_file is not None:
+                hit.save(out_file)
+            return hit
 
-    if debug:
-        cmd += [
-            "--temperature", "0.0",
-            "--top-p", "1.0",
-            "--top-k", "1",
-            "--seed", "42",
-        ]
+    if stream:
+        timer = ArrivalTimer()
+        stdout, stderr = stream_process(cmd, timer)
+        timer.apply_to(report)
     else:
-        if max_batch_size is not None:
-            cmd += ["--max-batch-size", str(max_batch_size)]
-            report.max_batch_size = max_batch_size
-        if temperature is not None:
-            cmd += ["--temperature", str(temperature)]
-            report.temperature = temperature
-        if top_p is not None:
-            cmd += ["--top-p", str(top_p)]
-            report.top_p = top_p
-        if top_k is not None:
-            cmd += ["--top-k", str(top_k)]
-            report.top_k = top_k
-        if seed is not None:
-            cmd += ["--seed", str(seed)]
-            report.seed = seed
+        model_output = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        stdout, stderr = model_output.stdout, model_output.stderr
+    report.parse_stdout(stdout)
+    report.parse_error(stderr)
 
-    model_output = subprocess.run(
-        cmd,
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    report.parse_stdout(model_output.stdout)
-    report.parse_error(model_output.stderr)
+    if key is not None and report.error is None:
+        cache.put(key, report)
 
     if out_file is not None:
-        with open(out_file, "w") as f:
-            f.write(str(report.as_json()))
+        report.save(out_file)
 
     return report
 
@@ -79,17 +99,47 @@ def main():
     parser.add_argument("--top-p", type=float)
     parser.add_argument("--top-k", type=int)
     parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--backend",
+        choices=["pixi", "server"],
+        default="pixi",
+        help="pixi spawns `max generate` per prompt, server talks to a running `max serve`",
+    )
+    parser.add_argument("--server-url", type=str, default=DEFAULT_SERVER_URL)
+    parser.add_argument("--no-cache", action="store_true", help="always run the model, even for deterministic params")
+    parser.add_argument("--stream", action="store_true", help="read output as it arrives and record per-token timings")
+    parser.add_argument("--store", type=str, help="also append the report to this results store")
     args = parser.parse_args()
 
-    run_pixi_generate(
-        prompt=args.prompt,
-        out_file=args.file,
-        max_batch_size=args.max_batch_size,
-        temperature=args.temperature,
-        top_p=args.top_p,
-        top_k=args.top_k,
-        seed=args.seed,
-    )
+    if args.backend == "server":
+        with ServerClient(args.server_url) as client:
+            report = run_server_generate(
+                prompt=args.prompt,
+                out_file=args.file,
+                max_batch_size=args.max_batch_size,
+                temperature=args.temperature,
+                top_p=args.top_p,
+                top_k=args.top_k,
+                seed=args.seed,
+                client=client,
+                use_cache=not args.no_cache,
+                stream=args.stream,
+            )
+    else:
+        report = run_pixi_generate(
+            prompt=args.prompt,
+            out_file=args.file,
+            max_batch_size=args.max_batch_size,
+            temperature=args.temperature,
+            top_p=args.top_p,
+            top_k=args.top_k,
+            seed=args.seed,
+            use_cache=not args.no_cache,
+            stream=args.stream,
+        )
+
+    if args.store is not None:
+        ResultsStore(args.store).append(report, backend=args.backend)
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,13 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import json
 from typing import Optional, Dict
 import re
 
 
+def _clean(text: str) -> str:
+    return text.strip().replace("\n", "").replace("\"", "").replace("'", "")
+
+
 @dataclass()
 class ModelReport:
     prompt: Optional[str] = None
@@ -24,6 +28,16 @@ class ModelReport:
     output_tokens_per_second: Optional[float] = None
     latency_ms: Optional[float] = None
     first_token_latency_ms: Optional[float] = None
+    # client-side timings, only filled in by streaming runs.  a "chunk" is
+    # whatever arrived in one read, which is usually (not always) one token
+    stream_chunks: Optional[int] = None
+    client_first_token_ms: Optional[float] = None
+    inter_token_p50_ms: Optional[float] = None
+    inter_token_p95_ms: Optional[float] = None
+    inter_token_max_ms: Optional[float] = None
+    # true when the report was served from the generation cache, in which case
+    # the timings above are the ones measured by the original run
+    cache_hit: bool = False
     # timestamp: datetime = field(default_factory=datetime.timezone.utcnow)
 
     @property
@@ -44,6 +58,15 @@ class ModelReport:
     def as_json(self) -> str:
         return json.dumps(self.as_dict())
     
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ModelReport":
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write(str(self.as_json()))
+
     def parse_stdout(self, stdout: str) -> None:
         patterns = {
             "prompt_size": r"Prompt size:\s*(\d+)",
@@ -68,14 +91,34 @@ class ModelReport:
         split = re.split(r"\nPrompt size:\s*\d+", stdout, maxsplit=1)
         if len(split) == 2:
             body = split[0]
-            self.output = (
-                body.split("Beginning text generation", 1)[-1].strip().replace("\n", "").replace("\"", "").replace("'", "")
-            )
+            self.output = _clean(body.split("Beginning text generation", 1)[-1])
+
+    def parse_completion(self, response: Dict, latency_ms: float) -> None:
+        """
+        fills the report from an OpenAI-compatible `/v1/completions` response.
+        the server doesn't print MAX's summary block, so timings are measured
+        on our side of the connection instead
+        """
+        choices = response.get("choices") or []
+        if choices:
+            self.output = _clean(choices[0].get("text") or "")
+
+        usage = response.get("usage") or {}
+        if usage.get("prompt_tokens") is not None:
+            self.prompt_size = int(usage["prompt_tokens"])
+        if usage.get("completion_tokens") is not None:
+            self.output_size = int(usage["completion_tokens"])
+
+        self.latency_ms = latency_ms
+        if latency_ms > 0:
+            self.instructions_per_sec = 1000 / latency_ms
+            if self.output_size:
+                self.output_tokens_per_second = self.output_size / (latency_ms / 1000)
 
     def parse_error(self, stderr: str) -> None:
         errtext = ""
         for line in stderr.splitlines():
             if "error:" in line.lower():
-                errtext += line.strip().replace("\n", "").replace("\"", "").replace("'", "") + ","
+                errtext += _clean(line) + ","
         if errtext != "":
             self.error = errtext.strip()
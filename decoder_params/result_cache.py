@@ -0,0 +1,165 @@
+"""
+on-disk cache of generation results for deterministic runs.  with greedy decoding
+(temperature 0 or top_k 1, which includes DEBUG_MODE) the same prompt and params
+always give the same output, so there's no point paying for the model twice.
+
+entries are content-addressed: the key is a hash of everything that can change
+the output.  set GENERATION_CACHE=0 (or pass `use_cache=False`) to bypass it
+"""
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+from modelreport import ModelReport
+from decoding import MAX_LENGTH, MAX_NEW_TOKENS, MODEL_ID, DecoderParams, prompt_template
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "decoder_params", "generations")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE_S = 30 * 24 * 60 * 60
+EVICT_EVERY = 256  # puts between full scans, which also catch expiry and other processes' writes
+EVICT_TO = 0.9  # once over `max_bytes`, evict down to this share of it so the next put doesn't scan again
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("GENERATION_CACHE", "1").lower() not in ("0", "false")
+
+
+def cache_key(prompt: str, params: DecoderParams, backend: str, model: str = MODEL_ID) -> str:
+    """
+    `params` should be the resolved params, ie what was actually sent to the model
+    """
+    key = {
+        "model": model,
+        "backend": backend,
+        "prompt": prompt_template(prompt),
+        "max_length": MAX_LENGTH,
+        "max_new_tokens": MAX_NEW_TOKENS,
+        **params.__dict__,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class GenerationCache:
+    """
+    one json file per entry, fanned out by key prefix.  a hit touches the file's
+    mtime so eviction (oldest first once over `max_bytes`) behaves like LRU, and
+    anything older than `max_age_s` is treated as a miss and removed.
+
+    `put` keeps a running total of the cache size instead of walking the
+    directory every time: it only scans when the total crosses `max_bytes`, or
+    every `EVICT_EVERY` puts since other processes write here too
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_s: float = DEFAULT_MAX_AGE_S,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._size: Optional[int] = None  # bytes on disk as of the last scan, plus our puts since
+        self._puts = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[ModelReport]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_s:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                report = ModelReport.from_dict(json.load(f))
+            os.utime(path)
+        except (OSError, json.JSONDecodeError):
+            return None
+        report.cache_hit = True
+        return report
+
+    def put(self, key: str, report: ModelReport) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(report.as_json())
+        size = os.path.getsize(tmp)
+        try:
+            size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp, path)  # atomic, so concurrent sweep workers never see half a file
+
+        self._puts += 1
+        if self._size is None or self._puts >= EVICT_EVERY:
+            self.evict()
+            return
+        self._size += size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """
+        drops expired entries, then, if the cache is over `max_bytes`, the least
+        recently used ones until it's down to `EVICT_TO` of that.  returns how
+        many entries were removed
+        """
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else int(self.max_bytes * EVICT_TO)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age_s and total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._size = total
+        self._puts = 0
+        return removed
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+        self._puts = 0
+
+
+_DEFAULT_CACHE: Optional[GenerationCache] = None
+
+
+def default_cache() -> Optional[GenerationCache]:
+    """
+    the shared cache, or None when it has been switched off via the environment
+    """
+    global _DEFAULT_CACHE
+    if not cache_enabled():
+        return None
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = GenerationCache(os.environ.get("GENERATION_CACHE_DIR", DEFAULT_CACHE_DIR))
+    return _DEFAULT_CACHE
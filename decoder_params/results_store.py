@@ -0,0 +1,153 @@
+"""
+append-only store for ModelReports.  instead of one json file per run (and
+hand-stitched aggregates like haiku.json) every run becomes one line of a jsonl
+part file, partitioned by day:
+
+    results/
+        date=2026-10-18/
+            part-<host>-<pid>.jsonl
+
+each writing process gets its own part file, so concurrent sweeps never
+interleave lines.  reading goes column by column into flat arrays rather than
+building a ModelReport per row, which keeps thousands of runs cheap to analyse
+"""
+from array import array
+from dataclasses import fields
+import datetime
+import json
+import math
+import os
+import socket
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from modelreport import ModelReport
+
+REPORT_FIELDS = [f.name for f in fields(ModelReport)]
+NUMERIC_FIELDS = {
+    f.name for f in fields(ModelReport)
+    if f.name not in ("prompt", "output", "error", "cache_hit")
+}
+INT_FIELDS = {f.name for f in fields(ModelReport) if f.type == Optional[int]}
+
+
+class ResultsStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._part = f"part-{socket.gethostname()}-{os.getpid()}.jsonl"
+
+    def append(self, report: ModelReport, **tags) -> None:
+        """
+        `tags` (eg `sweep="haiku"`, `backend="server"`) are stored alongside the
+        report fields and can be grouped on like any other column
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        row = report.as_dict()
+        row.update(tags)
+        row["ts"] = now.isoformat()
+        partition = os.path.join(self.root, f"date={now.date().isoformat()}")
+        line = json.dumps(row) + "\n"
+        with self._lock:
+            os.makedirs(partition, exist_ok=True)
+            with open(os.path.join(partition, self._part), "a") as f:
+                f.write(line)
+
+    def part_files(self) -> List[str]:
+        parts = []
+        for root, _, files in os.walk(self.root):
+            parts += [os.path.join(root, name) for name in files if name.endswith(".jsonl")]
+        return sorted(parts)
+
+    def rows(self) -> Iterator[Dict]:
+        for path in self.part_files():
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+    def columns(self, names: Sequence[str]) -> "ReportColumns":
+        return ReportColumns.from_rows(self.rows(), names)
+
+
+class ReportColumns:
+    """
+    record-array view of many reports: numeric fields are `array('d')` with NaN
+    for missing values, everything else is a plain list.  only the requested
+    columns are kept
+    """
+    __slots__ = ("names", "data", "size")
+
+    def __init__(self, names: Sequence[str]):
+        self.names = list(names)
+        self.data: Dict[str, object] = {
+            n: array("d") if n in NUMERIC_FIELDS else [] for n in self.names
+        }
+        self.size = 0
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Dict], names: Sequence[str]) -> "ReportColumns":
+        cols = cls(names)
+        for row in rows:
+            cols.append(row)
+        return cols
+
+    def append(self, row: Dict) -> None:
+        for n in self.names:
+            value = row.get(n)
+            if n in NUMERIC_FIELDS:
+                self.data[n].append(math.nan if value is None else float(value))
+            else:
+                self.data[n].append(value)
+        self.size += 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str):
+        return self.data[name]
+
+    def report(self, i: int) -> ModelReport:
+        """
+        materialises a single row, for when you actually want to look at one
+        """
+        values = {}
+        for n in self.names:
+            if n not in REPORT_FIELDS:
+                continue
+            value = self.data[n][i]
+            if n in NUMERIC_FIELDS and math.isnan(value):
+                value = None
+            elif n in INT_FIELDS:
+                value = int(value)
+            values[n] = value
+        return ModelReport.from_dict(values)
+
+
+def iter_json_objects(text: str) -> Iterator[Dict]:
+    """
+    our older aggregates (haiku.json, eclipses.json) are several json objects
+    pasted one after another, which `json.loads` won't take in one go
+    """
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return
+        obj, pos = decoder.raw_decode(text, pos)
+        yield obj
+
+
+def ingest_files(store: ResultsStore, paths: Iterable[str], **tags) -> int:
+    count = 0
+    for path in paths:
+        with open(path) as f:
+            text = f.read()
+        for obj in iter_json_objects(text):
+            store.append(ModelReport.from_dict(obj), source=os.path.basename(path), **tags)
+            count += 1
+    return count
+
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+`pixi r max generate` loads the weights and compiles the graph on every call,
+which costs far more than the generation itself.  this backend instead talks to
+one long-running OpenAI-compatible server (eg `pixi r max serve --model ...`)
+and reuses keep-alive connections between prompts
+"""
+import http.client
+import json
+import queue
+import time
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+from modelreport import ModelReport
+from decoding import MAX_NEW_TOKENS, MODEL_ID, DecoderParams, debug_mode, prompt_template
+from result_cache import cache_key, default_cache
+from streaming import ArrivalTimer
+
+DEFAULT_SERVER_URL = "http://localhost:8000"
+
+
+class ServerClient:
+    """
+    a small pool of persistent HTTP connections to one server.  connections are
+    handed out per request and returned afterwards, so it is safe to share a
+    client between threads
+    """
+
+    def __init__(
+        self,
+        url: str = DEFAULT_SERVER_URL,
+        model: str = MODEL_ID,
+        pool_size: int = 4,
+        timeout: float = 300.0,
+    ):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported server url: {url}")
+        self.model = model
+        self.timeout = timeout
+        self._https = parsed.scheme == "https"
+        self._host = parsed.hostname or "localhost"
+        self._port = parsed.port
+        self._base_path = parsed.path.rstrip("/")
+        self._pool: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._https:
+            return http.client.HTTPSConnection(self._host, self._port, timeout=self.timeout)
+        return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout)
+
+    def _acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def post(self, path: str, payload: Dict) -> Dict:
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        conn = self._acquire()
+        try:
+            try:
+                conn.request("POST", self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # the server dropped an idle keep-alive connection, retry once on a fresh one
+                conn.close()
+                conn = self._connect()
+                conn.request("POST", self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        if response.status >= 400:
+            raise RuntimeError(f"server returned {response.status}: {data.decode(errors='replace')}")
+        return json.loads(data)
+
+    def post_stream(self, path: str, payload: Dict) -> Iterator[Dict]:
+        """
+        posts a `"stream": true` request and yields each server-sent event as it
+        arrives.  the connection only goes back in the pool if the stream was read
+        to the end
+        """
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream", "Connection": "keep-alive"}
+        conn = self._acquire()
+        reusable = False
+        try:
+            try:
+                conn.request("POST", self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                conn = self._connect()
+                conn.request("POST", self._base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+
+            if response.status >= 400:
+                data = response.read()
+                raise RuntimeError(f"server returned {response.status}: {data.decode(errors='replace')}")
+
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    response.read()
+                    break
+                yield json.loads(data)
+            reusable = not response.will_close
+        finally:
+            if reusable:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self) -> "ServerClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def completion_payload(model: str, prompt: str, params: DecoderParams) -> Dict:
+    payload = {
+        "model": model,
+        "prompt": prompt_template(prompt),
+        "max_tokens": MAX_NEW_TOKENS,
+    }
+    payload.update(params.as_request_fields())
+    return payload
+
+
+def _read_stream(client: ServerClient, payload: Dict, timer: ArrivalTimer) -> Dict:
+    """
+    consumes a streamed completion, timing every non-empty chunk, and stitches it
+    back into the shape of a non-streamed response
+    """
+    payload = dict(payload, stream=True, stream_options={"include_usage": True})
+    text = ""
+    usage: Dict = {}
+    for event in client.post_stream("/v1/completions", payload):
+        for choice in event.get("choices") or []:
+            piece = choice.get("text") or ""
+            if piece:
+                timer.mark()
+                text += piece
+        if event.get("usage"):
+            usage = event["usage"]
+    return {"choices": [{"text": text}], "usage": usage}
+
+
+def run_server_generate(
+    prompt: str,
+    out_file: Optional[str] = None,
+    max_batch_size: int = 1,
+    temperature: Optional[float] = 0.2,
+    top_p: Optional[float] = 0.9,
+    top_k: Optional[int] = 50,
+    seed: int = 42,
+    client: Optional[ServerClient] = None,
+    use_cache: bool = True,
+    stream: bool = False,
+) -> ModelReport:
+    """
+    same contract as `run_pixi_generate`, but against a running server.  note that
+    `max_batch_size` is a server launch option, so here it is only recorded
+    """
+    report = ModelReport()
+    report.prompt = prompt
+
+    params = DecoderParams(
+        max_batch_size=max_batch_size,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        seed=seed,
+    )
+    if not debug_mode():
+        params.apply_to(report)
+    resolved = params.resolve()
+
+    cache = default_cache() if use_cache else None
+    key = None
+    if cache is not None and resolved.is_deterministic:
+        key = cache_key(prompt, resolved, backend="server", model=client.model if client else MODEL_ID)
+        # a streaming run is after fresh timings, so it may refresh the cache but never reads it
+        hit = None if stream else cache.get(key)
+        if hit is not None:
+            if out_file is not None:
+                hit.save(out_file)
+            return hit
+
+    owns_client = client is None
+    if client is None:
+        client = ServerClient()
+
+    payload = completion_payload(client.model, prompt, resolved)
+    timer = ArrivalTimer()
+    try:
+        start = time.perf_counter()
+        if stream:
+            timer.start(start)
+            response = _read_stream(client, payload, timer)
+        else:
+            response = client.post("/v1/completions", payload)
+        latency_ms = (time.perf_counter() - start) * 1000
+    finally:
+        if owns_client:
+            client.close()
+
+    if stream:
+        timer.apply_to(report)
+
+    report.parse_completion(response, latency_ms)
+
+    if key is not None and report.error is None:
+        cache.put(key, report)
+
+    if out_file is not None:
+        report.save(out_file)
+
+    return report
@@ -0,0 +1,116 @@
+"""
+client-side timing for streamed generations.  MAX's own summary only gives us
+averages (`latency_ms`, `output_tokens_per_second`), which hide the odd long
+stall between tokens; timestamping each chunk as it reaches us shows them
+"""
+import codecs
+import os
+import subprocess
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from modelreport import ModelReport
+from stats import percentile
+
+
+class ArrivalTimer:
+    """
+    call `start()` when the request goes out (or generation begins) and `mark()`
+    every time a non-empty chunk of output arrives.  `start(at)` takes a
+    `time.perf_counter()` reading the caller already has.
+
+    a chunk is stamped when the read that carries it returns, so timings are
+    only as fine as the reads.  if the first output comes in the same read that
+    would start the clock there's nothing to measure: don't `start()`, and
+    `first_token_ms` stays None rather than a made-up ~0
+    """
+
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.arrivals: List[float] = []
+
+    def start(self, at: Optional[float] = None) -> None:
+        self.started = time.perf_counter() if at is None else at
+
+    def mark(self) -> None:
+        self.arrivals.append(time.perf_counter())
+
+    @property
+    def first_token_ms(self) -> Optional[float]:
+        if self.started is None or not self.arrivals:
+            return None
+        return (self.arrivals[0] - self.started) * 1000
+
+    @property
+    def gaps_ms(self) -> List[float]:
+        return [(b - a) * 1000 for a, b in zip(self.arrivals, self.arrivals[1:])]
+
+    def apply_to(self, report: ModelReport) -> None:
+        report.stream_chunks = len(self.arrivals)
+        report.client_first_token_ms = self.first_token_ms
+        gaps = self.gaps_ms
+        if gaps:
+            report.inter_token_p50_ms = percentile(gaps, 50)
+            report.inter_token_p95_ms = percentile(gaps, 95)
+            report.inter_token_max_ms = max(gaps)
+
+
+GENERATION_MARKER = "Beginning text generation"
+METRICS_MARKER = "\nPrompt size:"
+
+
+def stream_process(cmd: List[str], timer: ArrivalTimer) -> Tuple[str, str]:
+    """
+    runs `cmd` like `subprocess.run(..., capture_output=True, check=True)` but reads
+    stdout as it is produced.  chunks are only timed between MAX's "Beginning text
+    generation" line and its metrics block, so startup and the summary are excluded
+    """
+    env = dict(os.environ, PYTHONUNBUFFERED="1")  # otherwise the child block-buffers into our pipe
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+
+    # drain stderr on the side so a chatty child can't fill the pipe and stall
+    err_chunks: List[bytes] = []
+    err_thread = threading.Thread(target=lambda: err_chunks.append(proc.stderr.read()), daemon=True)
+    err_thread.start()
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    out = ""
+    seen: Optional[int] = None  # how far into `out` the generated text has been timed
+    finished = False
+    fd = proc.stdout.fileno()
+    while True:
+        data = os.read(fd, 4096)
+        if not data:
+            break
+        out += decoder.decode(data)
+        if finished:
+            continue
+        starting = seen is None
+        if starting:
+            pos = out.find(GENERATION_MARKER)
+            newline = out.find("\n", pos) if pos != -1 else -1
+            if newline == -1:
+                continue
+            seen = newline + 1
+        end = out.find(METRICS_MARKER, max(seen - len(METRICS_MARKER), 0))
+        if end != -1:
+            finished = True
+        else:
+            end = len(out)
+        produced = bool(out[seen:end].strip())
+        if starting and not produced:
+            timer.start()
+        if produced:
+            # output in the marker's own read leaves the timer unstarted, TTFT unknown
+            timer.mark()
+        seen = max(seen, end)
+
+    out += decoder.decode(b"", final=True)
+    proc.stdout.close()
+    returncode = proc.wait()
+    err_thread.join()
+    err = b"".join(err_chunks).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=out, stderr=err)
+    return out, err
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+a tiny stand-in for `max serve` that speaks just enough of the OpenAI completions
+API to exercise the server backend without a GPU:
+
+    ./stub_server.py --port 8000 &
+    ./inference_tests.py --backend server --file stub_test --prompt "hello"
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+
+def fake_completion(payload: Dict) -> Dict:
+    prompt = str(payload.get("prompt", ""))
+    words = prompt.replace("<start_of_turn>", "").replace("<end_of_turn>", "").split()
+    max_tokens = int(payload.get("max_tokens", 16))
+    text = " ".join(reversed(words))[: max_tokens * 4]
+    return {
+        "id": "cmpl-stub",
+        "object": "text_completion",
+        "model": payload.get("model"),
+        "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(words),
+            "completion_tokens": len(text.split()),
+            "total_tokens": len(words) + len(text.split()),
+        },
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+    disable_nagle_algorithm = True  # otherwise small streamed chunks sit in the send buffer
+    delay_s = 0.0
+    token_delay_s = 0.0
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.rstrip("/").endswith("/v1/completions"):
+            time.sleep(self.delay_s)
+            if payload.get("stream"):
+                self._send_stream(fake_completion(payload))
+            else:
+                self._send(200, fake_completion(payload))
+        else:
+            self._send(404, {"error": {"message": f"no route for {self.path}"}})
+
+    def _send(self, status: int, body: Dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, completion: Dict) -> None:
+        """
+        replays the completion one word per server-sent event, the way the real
+        server emits tokens, using chunked transfer so the connection stays open
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(event: str) -> None:
+            data = f"data: {event}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for word in completion["choices"][0]["text"].split(" "):
+            time.sleep(self.token_delay_s)
+            chunk(json.dumps({"choices": [{"index": 0, "text": word + " "}]}))
+        chunk(json.dumps({"choices": [], "usage": completion["usage"]}))
+        chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def make_server(host: str, port: int, delay_ms: float = 0.0, token_delay_ms: float = 0.0) -> ThreadingHTTPServer:
+    handler = type(
+        "ConfiguredStubHandler",
+        (StubHandler,),
+        {"delay_s": delay_ms / 1000, "token_delay_s": token_delay_ms / 1000},
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_stub_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    delay_ms: float = 0.0,
+    token_delay_ms: float = 0.0,
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    starts the stub on a background thread and returns it with its base url.
+    port 0 picks a free port
+    """
+    server = make_server(host, port, delay_ms, token_delay_ms)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--token-delay-ms", type=float, default=0.0, help="gap between streamed tokens")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay_ms, args.token_delay_ms)
+    print(f"stub server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
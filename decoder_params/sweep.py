@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+declarative parameter sweeps.  a spec file lists one or more grids, each grid is
+the cartesian product of its axes, and the union of all grids (minus duplicates)
+is run through a bounded worker pool:
+
+    {
+      "name": "haiku",
+      "grids": [
+        {
+          "prompt": ["write a haiku about a random historical figure"],
+          "decoding": [
+            {"top_p": 1.0, "top_k": 1, "temperature": 0.0},
+            {"top_p": 0.9, "top_k": 50, "temperature": 0.2}
+          ],
+          "seed": [42, 7]
+        }
+      ]
+    }
+
+axes are `prompt`, `temperature`, `top_p`, `top_k`, `seed`, `max_batch_size`.
+`decoding` is a list of dicts for params that should move together rather than
+be crossed with each other.  every finished cell is appended to a checkpoint
+file, so re-running the same spec picks up where an interrupted sweep stopped
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, fields
+import hashlib
+from itertools import product
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from modelreport import ModelReport
+from decoding import DecoderParams
+from inference_tests import run_pixi_generate
+from results_store import ResultsStore
+from server_backend import DEFAULT_SERVER_URL, ServerClient, run_server_generate
+
+PARAM_AXES = [f.name for f in fields(DecoderParams)]
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+
+@dataclass(frozen=True)
+class SweepCell:
+    prompt: str
+    params: DecoderParams
+
+    @property
+    def cell_id(self) -> str:
+        """
+        stable across runs and machines, so it can be used to resume
+        """
+        key = json.dumps({"prompt": self.prompt, **self.params.__dict__}, sort_keys=True)
+        return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def expand_grid(grid: Dict, defaults: DecoderParams) -> List[SweepCell]:
+    prompts = grid.get("prompt")
+    if not prompts:
+        raise ValueError("every grid needs at least one prompt")
+    unknown = set(grid) - set(PARAM_AXES) - {"prompt", "decoding"}
+    if unknown:
+        raise ValueError(f"unknown sweep axes: {sorted(unknown)}")
+
+    axes = [a for a in PARAM_AXES if a in grid]
+    bundles = grid.get("decoding") or [{}]
+    cells: List[SweepCell] = []
+    for prompt, bundle, values in product(prompts, bundles, product(*[grid[a] for a in axes])):
+        overrides = dict(bundle)
+        overrides.update(zip(axes, values))
+        cells.append(SweepCell(prompt=prompt, params=defaults.with_overrides(**overrides)))
+    return cells
+
+
+def expand_spec(spec: Dict) -> List[SweepCell]:
+    """
+    expands every grid and drops duplicate cells, keeping first-seen order
+    """
+    defaults = DecoderParams().with_overrides(**spec.get("defaults", {}))
+    seen: Set[SweepCell] = set()
+    cells: List[SweepCell] = []
+    for grid in spec.get("grids", []):
+        for cell in expand_grid(grid, defaults):
+            if cell not in seen:
+                seen.add(cell)
+                cells.append(cell)
+    return cells
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """
+    returns the ids of cells that already completed successfully.  a truncated
+    last line (eg from a kill mid-write) is ignored
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("status") == "ok":
+                done.add(entry["cell_id"])
+    return done
+
+
+class SweepRunner:
+    def __init__(
+        self,
+        generate: Callable[..., ModelReport],
+        out_dir: str,
+        name: str = "sweep",
+        workers: int = 1,
+        store: Optional[ResultsStore] = None,
+    ):
+        self.generate = generate
+        self.store = store
+        self.out_dir = out_dir
+        self.name = name
+        self.workers = workers
+        self.checkpoint_path = os.path.join(out_dir, CHECKPOINT_FILE)
+        self._lock = threading.Lock()
+
+    def _record(self, entry: Dict) -> None:
+        with self._lock:
+            with open(self.checkpoint_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _run_cell(self, cell: SweepCell) -> Dict:
+        out_file = os.path.join(self.out_dir, f"{self.name}_{cell.cell_id}.json")
+        start = time.perf_counter()
+        entry = {"cell_id": cell.cell_id, "prompt": cell.prompt, **cell.params.__dict__}
+        try:
+            report = self.generate(prompt=cell.prompt, out_file=out_file, **cell.params.__dict__)
+            entry.update(status="ok", file=out_file)
+            if self.store is not None:
+                self.store.append(report, sweep=self.name, cell_id=cell.cell_id)
+        except Exception as e:
+            # one bad cell shouldn't take the rest of the sweep down with it
+            entry.update(status="error", error=f"{type(e).__name__}: {e}")
+        entry["wall_ms"] = (time.perf_counter() - start) * 1000
+        self._record(entry)
+        return entry
+
+    def run(self, cells: Iterable[SweepCell]) -> List[Dict]:
+        os.makedirs(self.out_dir, exist_ok=True)
+        done = load_checkpoint(self.checkpoint_path)
+        pending = [c for c in cells if c.cell_id not in done]
+        print(f"{len(done)} cells already done, {len(pending)} to run with {self.workers} workers")
+
+        results: List[Dict] = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._run_cell, c) for c in pending]
+            for future in as_completed(futures):
+                entry = future.result()
+                results.append(entry)
+                print(f"[{len(results)}/{len(pending)}] {entry['status']}\t{entry['cell_id']}\t{entry['wall_ms']:.0f}ms")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec", type=str, help="json sweep spec")
+    parser.add_argument("--out-dir", type=str)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--backend", choices=["pixi", "server"], default="pixi")
+    parser.add_argument("--server-url", type=str, default=DEFAULT_SERVER_URL)
+    parser.add_argument("--store", type=str, help="also append every report to this results store")
+    parser.add_argument("--dry-run", action="store_true", help="list the cells without running them")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    name = spec.get("name", os.path.splitext(os.path.basename(args.spec))[0])
+    out_dir = args.out_dir or spec.get("out_dir") or f"sweep_{name}"
+    cells = expand_spec(spec)
+
+    if args.dry_run:
+        for cell in cells:
+            print(cell.cell_id, json.dumps({"prompt": cell.prompt, **cell.params.__dict__}))
+        return
+
+    client: Optional[ServerClient] = None
+    generate: Callable[..., ModelReport] = run_pixi_generate
+    if args.backend == "server":
+        client = ServerClient(args.server_url, pool_size=args.workers)
+        generate = lambda **kw: run_server_generate(client=client, **kw)
+
+    try:
+        store = ResultsStore(args.store) if args.store else None
+        runner = SweepRunner(generate, out_dir, name=name, workers=args.workers, store=store)
+        results = runner.run(cells)
+    finally:
+        if client is not None:
+            client.close()
+
+    failed = [r for r in results if r["status"] != "ok"]
+    if failed:
+        print(f"{len(failed)} cells failed, re-run the same command to retry them")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
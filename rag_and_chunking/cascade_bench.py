@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+from corpus_index import load_or_build
+from tester import rank_cascade, rank_hybrid
+from typing import List
+import argparse
+import json
+import time
+
+import numpy as np
+
+"""
+how much cascade retrieval gives up against full hybrid scoring, and what it
+saves.  for every query the full `rank_hybrid` top k is the reference, and for
+each candidate depth `rank_cascade` reports
+
+    recall@k    share of the reference top k that the cascade's top k also has
+    top1        how often both put the same chunk first
+    ms/query    scoring time only (embedding is shared and done up front)
+
+    python cascade_bench.py test_doc.md bench_queries.json --k 10 --depth 20 50 100 200
+
+queries are one per line, or a query set json like bench_queries.json
+"""
+
+
+def read_queries(path: str) -> List[str]:
+    with open(path, "r") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return [q["query"] for q in json.loads(text)["queries"]]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def main() -> int:
+    from embedder import embed
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="source document the corpus index is built from")
+    parser.add_argument("queries", help="one query per line, or a query set json")
+    parser.add_argument("--index-dir", type=str)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--depth", type=int, nargs="+", default=[20, 50, 100, 200])
+    parser.add_argument("--method", choices=["linear", "rrf"], default="linear")
+    args = parser.parse_args()
+
+    index = load_or_build(args.path, args.index_dir)
+    queries = read_queries(args.queries)
+    vectors = np.atleast_2d(np.asarray(embed(queries), dtype=np.float32))
+
+    start = time.perf_counter()
+    full = [[i for i, _ in rank_hybrid(index, q, v, args.k, method=args.method)] for q, v in zip(queries, vectors)]
+    full_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    print(f"{len(index)} chunks, {len(queries)} queries, k={args.k}")
+    print(f"{'depth':>8}{f'recall@{args.k}':>12}{'top1':>8}{'ms/query':>10}")
+    print(f"{'full':>8}{1.0:>12.3f}{1.0:>8.3f}{full_ms:>10.3f}")
+    for depth in args.depth:
+        start = time.perf_counter()
+        cascade = [
+            [i for i, _ in rank_cascade(index, q, v, args.k, depth, method=args.method)]
+            for q, v in zip(queries, vectors)
+        ]
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(set(c) & set(f)) / len(f) for c, f in zip(cascade, full) if f])
+        top1 = np.mean([bool(c) and c[0] == f[0] for c, f in zip(cascade, full) if f])
+        print(f"{depth:>8}{recall:>12.3f}{top1:>8.3f}{ms:>10.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+from chunker import Chunk
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Union
+import json
+import os
+
+import numpy as np
+
+"""
+a compact, array-backed list of chunks.  a `Chunk` is a python object with its
+own copy of the text and its own meta dict, which for millions of chunks costs
+far more than the text itself.  a ChunkStore keeps:
+
+    data        every chunk's text, utf-8 encoded, back to back in one uint8 array
+    offsets     (n + 1,) int64, chunk i is data[offsets[i]:offsets[i + 1]]
+    columns     one array per meta key: int64 or float64 when every chunk has a
+                number there, otherwise int32 codes into a small table of values
+                (-1 where a chunk has no such key)
+
+indexing hands out `ChunkView`s, which look like chunks (`.txt`, `.meta`) but
+only hold the store and a position, and build the text and meta on access.
+anything that takes a list of chunks and only reads `.txt`/`.meta` can take a
+store instead.  `save` writes plain .npy files, which `load` memory-maps
+"""
+
+INT, FLOAT, CATEGORY = "int", "float", "category"
+
+
+class ChunkView(Chunk):
+    """
+    read-only: `meta` is rebuilt on every access, so changes to it aren't kept
+    """
+    __slots__ = ("store", "i")
+
+    def __init__(self, store: "ChunkStore", i: int):
+        self.store = store
+        self.i = i
+
+    @property
+    def txt(self) -> str:
+        return self.store.text(self.i)
+
+    @property
+    def meta(self) -> dict:
+        return self.store.meta(self.i)
+
+    def __repr__(self) -> str:
+        return f"ChunkView({self.i}, {self.txt[:40]!r})"
+
+
+def _column(values: List) -> Dict:
+    """
+    picks the narrowest representation for one meta key across all chunks
+    """
+    present = [v for v in values if v is not None]
+    if len(present) == len(values):
+        if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+            return {"kind": INT, "array": np.array(values, dtype=np.int64)}
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            return {"kind": FLOAT, "array": np.array(values, dtype=np.float64)}
+
+    # json text as the key so lists and dicts can be categories too
+    codes: Dict[str, int] = {}
+    table: List = []
+    array = np.full(len(values), -1, dtype=np.int32)
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        key = json.dumps(v, sort_keys=True)
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(table)
+            table.append(v)
+        array[i] = code
+    return {"kind": CATEGORY, "array": array, "values": table}
+
+
+class ChunkStore:
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, columns: Optional[Dict[str, Dict]] = None):
+        self.data = data
+        self.offsets = offsets
+        self.columns = columns or {}
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Chunk]) -> "ChunkStore":
+        encoded: List[bytes] = []
+        metas: List[dict] = []
+        for c in chunks:
+            encoded.append(c.txt.encode("utf-8", "surrogatepass"))
+            metas.append(c.meta)
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        keys: Dict[str, None] = {}
+        for m in metas:
+            keys.update(dict.fromkeys(m))
+        columns = {k: _column([m.get(k) for m in metas]) for k in keys}
+        return cls(data, offsets, columns)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[ChunkView, List[ChunkView]]:
+        if isinstance(i, slice):
+            return [ChunkView(self, j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"chunk {i} out of range for {len(self)} chunks")
+        return ChunkView(self, i)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        return (ChunkView(self, i) for i in range(len(self)))
+
+    def text(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8", "surrogatepass")
+
+    def texts(self, ids: Optional[Sequence[int]] = None) -> List[str]:
+        """
+        plain strings, for anything that wants a batch of them (the embedder, tokenizers)
+        """
+        return [self.text(i) for i in (range(len(self)) if ids is None else ids)]
+
+    def meta(self, i: int) -> dict:
+        meta = {}
+        for name, column in self.columns.items():
+            value = column["array"][i]
+            if column["kind"] == INT:
+                meta[name] = int(value)
+            elif column["kind"] == FLOAT:
+                meta[name] = float(value)
+            elif value >= 0:
+                meta[name] = column["values"][value]
+        return meta
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        one meta key for every chunk at once.  category columns come back as codes
+        """
+        return self.columns[name]["array"]
+
+    def save(self, directory: str, prefix: str = "chunks") -> None:
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, prefix)
+        np.save(base + "_data.npy", np.asarray(self.data, dtype=np.uint8))
+        np.save(base + "_offsets.npy", self.offsets)
+        layout = []
+        for j, (name, column) in enumerate(self.columns.items()):
+            np.save(f"{base}_meta{j}.npy", column["array"])
+            layout.append({"name": name, "kind": column["kind"], "values": column.get("values")})
+        with open(base + "_layout.json", "w") as f:
+            json.dump({"n_chunks": len(self), "columns": layout}, f)
+
+    @classmethod
+    def load(cls, directory: str, prefix: str = "chunks") -> "ChunkStore":
+        base = os.path.join(directory, prefix)
+        with open(base + "_layout.json") as f:
+            layout = json.load(f)["columns"]
+        columns = {}
+        for j, column in enumerate(layout):
+            columns[column["name"]] = {
+                "kind": column["kind"],
+                "array": np.load(f"{base}_meta{j}.npy", mmap_mode="r"),
+                "values": column["values"],
+            }
+        return cls(np.load(base + "_data.npy", mmap_mode="r"), np.load(base + "_offsets.npy", mmap_mode="r"), columns)
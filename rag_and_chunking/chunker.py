@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
+import codecs
+import mmap
+import os
 import re
 
-from typing import List
+from collections import deque
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
 
 class Chunk:
+    __slots__ = ("txt", "meta")
     txt: str
     meta: dict
 
@@ -21,43 +26,265 @@ def fixed_chunks(txt: str, chunk_size: int, overlap: int=0) -> List[Chunk]:
         chunks.append(
             Chunk(
                 txt=txt[i:i+chunk_size].replace("\n", ""),
-                meta={}
+                meta={"start": i, "end": i + chunk_size}
             )
         )
         i = i + (chunk_size - overlap)
 
+    # the last window usually doesn't line up with the end of the text, keep what's left
+    if i < len(txt) and (not chunks or chunks[-1].meta["end"] < len(txt)):
+        chunks.append(Chunk(txt=txt[i:].replace("\n", ""), meta={"start": i, "end": len(txt)}))
+
     return chunks
 
 
+MD_RE = [
+        re.compile(r"<h[0-9][\sA-z]*>.*"), # HTML headers
+        re.compile(r".*:.*"), # paragraph breaks (this is very aggressive and likely flawed)
+        re.compile(r"#{1,4}\s.*"), # markdown headers
+]
+
+
 def structure_aware(text: str) -> List[Chunk]:
     chunks: List[Chunk] = []
 
-    md_re = [
-            re.compile(r"<h[0-9][\sA-z]*>.*"), # HTML headers
-            re.compile(r".*:.*"), # paragraph breaks (this is very aggressive and likely flawed)
-            re.compile(r"#{1,4}\s.*"), # markdown headers
-    ]
+    md_re = MD_RE
     current_chunk_lines: List[str] = []
+    # character offsets of the current chunk within `text`
+    start = end = pos = 0
 
-    for line in text.splitlines():        
+    for line, raw_line in zip(text.splitlines(), text.splitlines(keepends=True)):
         match = any(s.match(line) for s in md_re)
         if match:
             if len(current_chunk_lines) > 0:
                 chunks.append(
-                    Chunk(txt=' '.join(current_chunk_lines), meta={})
+                    Chunk(txt=' '.join(current_chunk_lines), meta={"start": start, "end": end})
                 )
             current_chunk_lines = []
         else:
+            if len(current_chunk_lines) == 0:
+                start = pos
             current_chunk_lines.append(line)
+            end = pos + len(line)
+        pos += len(raw_line)
 
     if len(current_chunk_lines) > 0:
         chunks.append(
-            Chunk(txt=' '.join(current_chunk_lines), meta={})
+            Chunk(txt=' '.join(current_chunk_lines), meta={"start": start, "end": end})
         )
 
     return chunks
 
 
+# streaming versions of the above, for inputs too big to hold in memory.
+# they read a path, a binary file or an mmap in blocks, decode as they go and
+# yield chunks whose meta also carries byte offsets into the source.  memory
+# stays around one block plus one chunk whatever the size of the input.
+# undecodable bytes come through as surrogate escapes so byte offsets stay exact
+
+Source = Union[str, os.PathLike, BinaryIO, mmap.mmap, bytes]
+BLOCK_SIZE = 1 << 20
+
+
+def _nbytes(s: str) -> int:
+    return len(s) if s.isascii() else len(s.encode("utf-8", "surrogateescape"))
+
+
+def read_blocks(source: Source, block_size: int = BLOCK_SIZE) -> Iterator[str]:
+    """
+    decoded text of `source`, one block at a time.  a multi-byte character split
+    across two blocks is held back until the rest of it arrives
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("surrogateescape")
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from read_blocks(f, block_size)
+        return
+    if hasattr(source, "read") and not isinstance(source, mmap.mmap):
+        for block in iter(lambda: source.read(block_size), b""):
+            yield decoder.decode(block)
+    else:
+        view = memoryview(source)
+        for i in range(0, len(view), block_size):
+            yield decoder.decode(view[i:i + block_size])
+    yield decoder.decode(b"", final=True)
+
+
+class _TextBuffer:
+    """
+    the not-yet-chunked tail of the decoded text, in absolute character
+    positions, plus a cursor that turns character positions into byte offsets.
+    the cursor only moves forward so each character is measured about once
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.start = 0  # absolute char position of text[0]
+        self.cursor = 0
+        self.cursor_byte = 0
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def append(self, block: str) -> None:
+        self.text += block
+
+    def get(self, a: int, b: int) -> str:
+        return self.text[a - self.start:b - self.start]
+
+    def byte_of(self, char: int) -> int:
+        self.cursor_byte += _nbytes(self.get(self.cursor, char))
+        self.cursor = char
+        return self.cursor_byte
+
+    def drop_before(self, char: int) -> None:
+        self.byte_of(char)
+        self.text = self.text[char - self.start:]
+        self.start = char
+
+    def chunk(self, a: int, b: int) -> Chunk:
+        window = self.get(a, b)
+        byte_start = self.byte_of(a)
+        return Chunk(
+            txt=window.replace("\n", ""),
+            meta={"start": a, "end": b, "byte_start": byte_start, "byte_end": byte_start + _nbytes(window)},
+        )
+
+
+def iter_fixed_chunks(
+    source: Source,
+    chunk_size: int,
+    overlap: int = 0,
+    tokenizer=None,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[Chunk]:
+    """
+    `fixed_chunks` over a file.  sizes are characters, or tokens when a HF fast
+    `tokenizer` is given (windows then start and end on token boundaries)
+    """
+    if not 0 <= overlap < chunk_size:
+        raise ValueError(f"overlap must be in [0, chunk_size), got {overlap} for {chunk_size}")
+    if tokenizer is not None:
+        yield from _iter_token_chunks(source, chunk_size, overlap, tokenizer, block_size)
+        return
+
+    step = chunk_size - overlap
+    buf = _TextBuffer()
+    i = 0
+    emitted = False
+    for block in read_blocks(source, block_size):
+        buf.append(block)
+        while i + chunk_size <= buf.end:
+            yield buf.chunk(i, i + chunk_size)
+            emitted = True
+            i += step
+        buf.drop_before(i)
+
+    if buf.end - i > (overlap if emitted else 0):
+        yield buf.chunk(i, buf.end)
+
+
+def _iter_token_chunks(source: Source, chunk_size: int, overlap: int, tokenizer, block_size: int) -> Iterator[Chunk]:
+    """
+    text is tokenized up to the last newline of what has arrived so far, so no
+    token is cut in half by a block boundary.  only the character spans of the
+    tokens are kept, which is all that's needed to cut the windows
+    """
+    step = chunk_size - overlap
+    buf = _TextBuffer()
+    spans: deque = deque()  # (start, end) absolute char span of each pending token
+    tokenized = 0
+    emitted = False
+
+    def tokenize(upto: int) -> None:
+        nonlocal tokenized
+        encoded = tokenizer(buf.get(tokenized, upto), add_special_tokens=False, return_offsets_mapping=True)
+        spans.extend((tokenized + a, tokenized + b) for a, b in encoded["offset_mapping"] if b > a)
+        tokenized = upto
+
+    for block in read_blocks(source, block_size):
+        buf.append(block)
+        cut = buf.text.rfind("\n", tokenized - buf.start) + 1
+        if not cut and buf.end - tokenized > block_size:
+            # no newline for a whole block, settle for just before a space, and
+            # only cut mid-word if there hasn't been one of those for ages either
+            cut = max(buf.text.rfind(" ", tokenized - buf.start + 1), 0)
+            if not cut and buf.end - tokenized > 16 * block_size:
+                cut = len(buf.text)
+        if cut:
+            tokenize(buf.start + cut)
+        while len(spans) >= chunk_size:
+            yield buf.chunk(spans[0][0], spans[chunk_size - 1][1])
+            emitted = True
+            for _ in range(step):
+                spans.popleft()
+        buf.drop_before(spans[0][0] if spans else tokenized)
+
+    if buf.end > tokenized:
+        tokenize(buf.end)
+    while len(spans) > (overlap if emitted else 0):
+        yield buf.chunk(spans[0][0], spans[min(chunk_size, len(spans)) - 1][1])
+        emitted = True
+        if len(spans) <= chunk_size:
+            break
+        for _ in range(step):
+            spans.popleft()
+
+
+def iter_structure_aware(source: Source, max_chars: Optional[int] = None, block_size: int = BLOCK_SIZE) -> Iterator[Chunk]:
+    """
+    `structure_aware` over a file, line by line.  a section with no header for a
+    very long way is split every `max_chars` characters if that's set
+    """
+    current_chunk_lines: List[str] = []
+    current_chars = 0
+    start = end = start_byte = end_byte = 0
+    pos = pos_byte = 0
+    carry = ""
+
+    def flush() -> Chunk:
+        return Chunk(
+            txt=' '.join(current_chunk_lines),
+            meta={"start": start, "end": end, "byte_start": start_byte, "byte_end": end_byte},
+        )
+
+    def lines() -> Iterator[Tuple[str, str]]:
+        nonlocal carry
+        for block in read_blocks(source, block_size):
+            raw_lines = (carry + block).splitlines(keepends=True)
+            carry = ""
+            # keep a possibly unfinished last line (or a \r whose \n hasn't arrived) for the next block
+            if raw_lines and (raw_lines[-1].endswith("\r") or raw_lines[-1].splitlines()[0] == raw_lines[-1]):
+                carry = raw_lines.pop()
+            for raw_line in raw_lines:
+                yield raw_line.splitlines()[0], raw_line
+        if carry:
+            yield carry.splitlines()[0], carry
+
+    for line, raw_line in lines():
+        if any(s.match(line) for s in MD_RE):
+            if current_chunk_lines:
+                yield flush()
+            current_chunk_lines = []
+            current_chars = 0
+        else:
+            if max_chars and current_chunk_lines and current_chars + len(line) > max_chars:
+                yield flush()
+                current_chunk_lines = []
+                current_chars = 0
+            if not current_chunk_lines:
+                start, start_byte = pos, pos_byte
+            current_chunk_lines.append(line)
+            current_chars += len(line) + 1
+            end, end_byte = pos + len(line), pos_byte + _nbytes(line)
+        pos += len(raw_line)
+        pos_byte += _nbytes(raw_line)
+
+    if current_chunk_lines:
+        yield flush()
+
+
 def task_chunker(text: str):
     chunks: List[Chunk] = []
 
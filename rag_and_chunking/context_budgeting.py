@@ -4,14 +4,18 @@ from typing import List, Tuple
 import sys
 from pathlib import Path
 
-from transformers import AutoTokenizer
+import numpy as np
 
+# decoder_params' modules import each other by bare name, so import them that way too
 if __package__ is None:
-    sys.path.append(str(Path(__file__).resolve().parents[1]))
+    sys.path.append(str(Path(__file__).resolve().parents[1] / "decoder_params"))
 
 from chunker import Chunk
-from tester import build_chunks, get_hybrid, load_test_data
-from decoder_params.inference_tests import run_pixi_generate
+from corpus_index import load_or_build
+from tester import get_hybrid
+from token_store import TokenStore, pack_knapsack, pack_prefix
+from tracing import span
+from inference_tests import run_pixi_generate
 
 bad_prompt = "what are there restrictions on?" # vague, open-ended
 better_prompt = """
@@ -24,14 +28,7 @@ CONTEXT:
 QUESTION:
 what does markdown allow us to do?""" # convince the generator model to look at our context more specifically, with a better question
 
-_TOKENIZER = None
-
-
-def _get_tokenizer() -> AutoTokenizer:
-    global _TOKENIZER
-    if _TOKENIZER is None:
-        _TOKENIZER = AutoTokenizer.from_pretrained("google/gemma-3-4b-it", use_fast=True)
-    return _TOKENIZER
+TOKENIZER_NAME = "google/gemma-3-4b-it"
 
 
 def top_n(n: int, scores: List[Tuple[int, float]], chunks: List[Chunk]) -> str:
@@ -43,37 +40,40 @@ def top_n(n: int, scores: List[Tuple[int, float]], chunks: List[Chunk]) -> str:
     return ' '.join([chunks[idx].txt for idx, _ in top_scores])
 
 
-def get_tokens(n: int, scores: List[Tuple[int, float]], chunks: List[Chunk]) -> str:
+def get_tokens(
+    n: int,
+    scores: List[Tuple[int, float]],
+    chunks: List[Chunk],
+    tokens: TokenStore,
+    mode: str = "truncate",
+) -> str:
     """
-    returns a concatenated string of 'n' tokens from our hybrid-scored and
-    chunked data
+    returns a concatenated string of at most 'n' tokens from our hybrid-scored
+    and chunked data.  token counts come from `tokens`, normally
+    `index.token_store(TOKENIZER_NAME)` which tokenizes the corpus once and
+    keeps it, so nothing is tokenized here.
+
+    mode "truncate" takes chunks in rank order and cuts the last one to fit.
+    mode "knapsack" picks the whole chunks with the best total score that fit,
+    skipping any that are too big rather than truncating them
     """
-    tokenizer = _get_tokenizer()
-    rag_text = ""
-    token_count = 0
-
-    for idx, _ in scores:
-        chunk_tokens = tokenizer.encode(chunks[idx].txt, add_special_tokens=False)
-        diff = n - token_count
-        if len(chunk_tokens) > diff:
-            rag_text += tokenizer.decode(
-                chunk_tokens[:diff],
-                skip_special_tokens=True,
-                clean_up_tokenization_spaces=False,
-            )
-            new_tokens = diff
-        else:
-            rag_text += tokenizer.decode(
-                chunk_tokens,
-                skip_special_tokens=True,
-                clean_up_tokenization_spaces=False,
-            )
-            new_tokens = len(chunk_tokens)
-        rag_text += ' '
-        token_count += new_tokens
-        if token_count >= n:
-            break
-    return rag_text
+    with span("get_tokens", budget=n) as s:
+        order = np.fromiter((idx for idx, _ in scores), dtype=np.int64, count=len(scores))
+        if mode == "knapsack":
+            values = np.fromiter((score for _, score in scores), dtype=np.float64, count=len(scores))
+            chosen = pack_knapsack(order, tokens.counts, values, n)
+            s.count(chunks=len(chosen), tokens=int(tokens.counts[chosen].sum()))
+            return ' '.join(chunks[i].txt for i in chosen.tolist())
+        if mode != "truncate":
+            raise ValueError(f"unknown packing mode: {mode}")
+
+        whole, partial = pack_prefix(order, tokens.counts, n)
+        parts = [chunks[i].txt for i in whole.tolist()]
+        if partial:
+            last = int(order[len(whole)])
+            parts.append(tokens.prefix(chunks[last].txt, last, partial))
+        s.count(chunks=len(parts), tokens=int(tokens.counts[whole].sum()) + partial)
+        return ' '.join(parts)
 
 
 def generate(query: str, rag_text: str, out_file: str) -> str:
@@ -83,7 +83,13 @@ def generate(query: str, rag_text: str, out_file: str) -> str:
     """
     prompt = query.replace("<rag_token>", rag_text)
     print(f"prompting with '{prompt}'")
-    report = run_pixi_generate(prompt=prompt, out_file=out_file) 
+    with span("generate") as s:
+        report = run_pixi_generate(prompt=prompt, out_file=out_file)
+        s.count(
+            prompt_tokens=report.prompt_size or 0,
+            output_tokens=report.output_size or 0,
+            cache_hits=int(report.cache_hit),
+        )
     return report.output or ""
 
 
@@ -92,10 +98,10 @@ if __name__ == "__main__":
         raise SystemExit("supply a prompt please")
     query = sys.argv[1]
     path = sys.argv[2] if len(sys.argv) > 2 else "rag_and_chunking/test_doc.md"
-    test_data = load_test_data(path)
+    index = load_or_build(path)
 
-    scores = get_hybrid(query, path)
-    chunks = build_chunks(test_data)
+    scores = get_hybrid(query, path, index=index)
+    chunks = index.chunks
 
     # exercise 1 - generate with fixed N chunks
     # top_5 = top_n(5, scores, chunks)
@@ -107,8 +113,9 @@ if __name__ == "__main__":
     # output_1 = generate(better_prompt, top_1, out_file="top_1_test")
 
     # exercise 2 - generate with fixed token budget
-    fivetwelve = get_tokens(1024, scores, chunks)
-    # tentwentyfour = get_tokens(1024, scores, chunks)
+    tokens = index.token_store(TOKENIZER_NAME)
+    fivetwelve = get_tokens(1024, scores, chunks, tokens)
+    # tentwentyfour = get_tokens(1024, scores, chunks, tokens, mode="knapsack")
 
     output_1 = generate(better_prompt, fivetwelve, out_file="1024_test")
     # output_2 = generate(better_prompt, tentwentyfour, out_file="top_1_test")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+from chunk_store import ChunkStore
+from chunker import Chunk, fixed_chunks, structure_aware
+from dense_index import DenseIndex
+from hybrid import BM25Index
+from token_store import TokenStore
+from tracing import span
+from typing import Dict, List, Optional, Tuple
+import fcntl
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+"""
+every query used to re-read the doc, re-run semantic chunking and re-embed every
+chunk - and tester2 did all of that twice.  none of it depends on the query, so
+it now happens once, in an explicit build step:
+
+    python corpus_index.py build test_doc.md
+
+which writes `test_doc.md.index/` next to the source:
+    manifest.json       source hash, chunker settings, model, sizes
+    chunks_*.npy/json   chunk texts and meta as a ChunkStore
+    embeddings.npy      (n_chunks, d) float32, normalised
+    bm25_*.npy/json     the BM25Index postings and stats
+    tokens_<tok>_*.npy  generator token ids per chunk, written on first use
+
+queries memory-map that directory.  `load_or_build` rebuilds automatically when
+the source file or the chunker settings no longer match the manifest.  each
+build goes into its own `test_doc.md.index.<random>/` and `test_doc.md.index`
+is a symlink to the current one, swapped atomically (see `swap_in`)
+"""
+
+INDEX_VERSION = 2
+DEFAULT_CHUNKER: Dict = {"name": "semantic", "threshold": 0.75}
+
+
+class CorpusIndex:
+    def __init__(self, directory: str, manifest: Dict, chunks: ChunkStore, embeddings: np.ndarray, bm25: BM25Index):
+        self.directory = directory
+        self.manifest = manifest
+        self.chunks = chunks
+        self.embeddings = embeddings
+        self.bm25 = bm25
+        self._dense: Dict[str, DenseIndex] = {}
+        self._tokens: Dict[str, TokenStore] = {}
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def version(self) -> str:
+        """
+        changes whenever the index is rebuilt from different source, chunker or
+        model, so anything derived from it (eg cached query results) can tell
+        """
+        return hashlib.sha1(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:16]
+
+    def dense_scores(self, query_vector: np.ndarray, kind: str = "exact", ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        cosine similarity of every chunk (or just the chunks in `ids`) to an
+        already-embedded query.  vectors are normalised at build time, so this is
+        one matrix-vector product.  kind "float16" or "int8" scores against a
+        quantized copy instead
+        """
+        if kind == "exact":
+            embeddings = self.embeddings if ids is None else self.embeddings[ids]
+            return np.asarray(embeddings) @ np.ravel(query_vector)
+        return self.dense_index(kind).scores(query_vector, ids)[0]
+
+    def dense_index(self, kind: str = "exact") -> DenseIndex:
+        """
+        the exact backend works straight off the memory-mapped embeddings.  the
+        quantized and faiss ones are built the first time they're asked for and
+        saved into the index directory, so a rebuild of the corpus index throws
+        them away too
+        """
+        if kind not in self._dense:
+            path = os.path.join(self.directory, f"dense_{kind}")
+            if kind == "exact":
+                index = DenseIndex("exact")
+                index.vectors = self.embeddings
+            elif os.path.exists(path + ".json"):
+                index = DenseIndex.load(path)
+            else:
+                index = DenseIndex(kind).build(self.embeddings)
+                index.save(path)
+            self._dense[kind] = index
+        return self._dense[kind]
+
+    def token_store(self, tokenizer_name: str) -> TokenStore:
+        """
+        every chunk's token ids under the generator's tokenizer.  tokenized once,
+        the first time a tokenizer is asked for, and saved alongside the rest
+        """
+        if tokenizer_name not in self._tokens:
+            store = TokenStore.load(self.directory, tokenizer_name)
+            if store is None:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+                store = TokenStore.build(self.chunks.texts(), tokenizer, tokenizer_name)
+                store.save(self.directory)
+            self._tokens[tokenizer_name] = store
+        return self._tokens[tokenizer_name]
+
+    def search(self, query_vector: np.ndarray, k: int, kind: str = "exact") -> List[Tuple[int, float]]:
+        """
+        top k (chunk id, similarity) for one query, best first
+        """
+        scores, ids = self.dense_index(kind).search(query_vector, k)
+        return [(i, s) for i, s in zip(ids[0].tolist(), scores[0].tolist()) if i >= 0]
+
+
+def index_dir_for(path: str) -> str:
+    return f"{path}.index"
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_chunks(text: str, settings: Dict) -> List[Chunk]:
+    name = settings["name"]
+    with span("build_chunks", chars=len(text)) as s:
+        if name == "semantic":
+            from semantic_chunker import semantic_chunks
+            chunks = semantic_chunks(text, threshold=settings.get("threshold", 0.75))
+        elif name == "structure":
+            chunks = structure_aware(text)
+        elif name == "fixed":
+            chunks = fixed_chunks(text, settings["size"], settings.get("overlap", 0))
+        else:
+            raise ValueError(f"unknown chunker: {name}")
+        s.count(chunks=len(chunks))
+    return chunks
+
+
+def build_index(path: str, directory: Optional[str] = None, chunker: Optional[Dict] = None) -> CorpusIndex:
+    directory = directory or index_dir_for(path)
+    chunker = chunker or DEFAULT_CHUNKER
+    with open(path, "r") as f:
+        text = f.read().strip()
+
+    chunks = make_chunks(text, chunker)
+    return write_index(directory, chunks, {
+        "source": os.path.abspath(path),
+        "source_hash": file_hash(path),
+        "chunker": chunker,
+    })
+
+
+def write_index(directory: str, chunks: List[Chunk], manifest: Dict) -> CorpusIndex:
+    """
+    embeds the chunks and writes everything out.  `manifest` says where the
+    chunks came from (source, source_hash, chunker) and is stored as-is
+    """
+    # imported here so that just loading an index never pulls in torch
+    from embedder import MODEL_NAME, embed
+
+    embeddings = np.atleast_2d(np.asarray(embed([c.txt for c in chunks]), dtype=np.float32))
+    bm25 = BM25Index(chunks)
+
+    # build into a scratch dir of our own, so concurrent builders can't trip
+    # over each other, then swap it in
+    parent, name = os.path.split(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f"{name}.", dir=parent)
+    ChunkStore.from_chunks(chunks).save(tmp)
+    np.save(os.path.join(tmp, "embeddings.npy"), embeddings)
+    bm25.save(tmp)
+    manifest = {
+        "version": INDEX_VERSION,
+        **manifest,
+        "embedding_model": MODEL_NAME,
+        "n_chunks": len(chunks),
+        "dim": int(embeddings.shape[1]),
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.chmod(tmp, 0o755)  # mkdtemp makes it private
+    swap_in(directory, tmp)
+
+    return load_index(directory)
+
+
+def swap_in(directory: str, built: str) -> None:
+    """
+    points `directory` at the freshly built sibling dir `built`.  `directory`
+    is a symlink to the current build, and replacing a symlink is atomic, so
+    a reader always finds a whole index, old or new.  the swap runs under a
+    lock so two builders finishing together each remove the build they
+    replaced and none is left behind
+    """
+    with open(f"{directory}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        previous = None
+        if os.path.islink(directory):
+            previous = os.path.join(os.path.dirname(directory), os.readlink(directory))
+        elif os.path.isdir(directory):
+            # a plain dir from before builds were versioned: moved aside once,
+            # the only time a reader can find nothing
+            previous = tempfile.mkdtemp(prefix=f"{os.path.basename(directory)}.", dir=os.path.dirname(directory) or ".")
+            os.replace(directory, previous)
+        link = f"{built}.link"
+        os.symlink(os.path.basename(built), link)
+        os.replace(link, directory)
+        if previous is not None and os.path.abspath(previous) != os.path.abspath(built):
+            # readers that still have it mapped keep their open files
+            shutil.rmtree(previous, ignore_errors=True)
+
+
+def load_index(directory: str) -> CorpusIndex:
+    while True:
+        # the build itself, not the link, so files saved later (dense_*, tokens_*)
+        # land next to the embeddings they were made from even after a swap
+        build = os.path.realpath(directory)
+        try:
+            with open(os.path.join(build, "manifest.json")) as f:
+                manifest = json.load(f)
+            chunks = ChunkStore.load(build)
+            embeddings = np.load(os.path.join(build, "embeddings.npy"), mmap_mode="r")
+            return CorpusIndex(build, manifest, chunks, embeddings, BM25Index.load(build))
+        except FileNotFoundError:
+            if os.path.realpath(directory) == build:
+                raise
+            # swapped out and removed halfway through reading it, take the new one
+
+
+def is_stale(path: str, directory: str, chunker: Dict) -> bool:
+    try:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return True
+    return (
+        manifest.get("version") != INDEX_VERSION
+        or manifest.get("chunker") != chunker
+        or manifest.get("source_hash") != file_hash(path)
+    )
+
+
+def load_or_build(path: str, directory: Optional[str] = None, chunker: Optional[Dict] = None) -> CorpusIndex:
+    directory = directory or index_dir_for(path)
+    chunker = chunker or DEFAULT_CHUNKER
+    if is_stale(path, directory, chunker):
+        with span("build_index") as s:
+            index = build_index(path, directory, chunker)
+            s.count(chunks=len(index))
+        return index
+    with span("load_index") as s:
+        index = load_index(directory)
+        s.count(chunks=len(index))
+    return index
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "build":
+        raise SystemExit("usage: corpus_index.py build <path> [index dir]")
+    source = sys.argv[2]
+    index = build_index(source, sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f"indexed {len(index)} chunks from {source} into {index.directory}")
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+from typing import Optional, Tuple
+import json
+import math
+import operator
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # the exact backend works without it
+    faiss = None
+
+"""
+pluggable dense retrieval.  `best_match` scores every chunk and then the caller
+sorts all of them, which is fine for one markdown file and hopeless for a real
+corpus.  every backend here answers "top k chunks for these query vectors":
+
+    exact   numpy matrix product + argpartition, no faiss needed
+    float16 the same scan over a float16 copy of the vectors - half the memory
+    int8    the same scan over int8 codes with one scale per dimension -
+            a quarter of the memory.  the scale is folded into the query, so
+            scoring never rebuilds the float matrix
+    flat    faiss IndexFlatIP - still exact, but faiss's BLAS path
+    ivf     faiss IndexIVFFlat - clusters the vectors and only searches the
+            `nprobe` closest clusters.  needs training, fast, approximate
+    hnsw    faiss IndexHNSWFlat - graph search, no training, very good recall
+
+all of them use inner product, which is cosine similarity for our normalised
+vectors.  `recall_at_k` measures an approximate backend against `exact`.
+the quantized scans convert `SCAN_BLOCK` rows at a time to float32, so the
+temporary stays small enough to sit in cache
+"""
+
+KINDS = ("exact", "float16", "int8", "flat", "ivf", "hnsw")
+SCAN_KINDS = ("exact", "float16", "int8")
+SCAN_BLOCK = 4096
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    top k of each row of a (n_queries, n_chunks) score matrix, best first.
+    k is clamped to n_chunks, and k <= 0 gives (n_queries, 0) arrays.
+    `argpartition` finds each row's k-th best score in linear time; the chunks
+    above it plus the lowest ids of those tied with it make exactly k per row,
+    and only those get sorted.  so ties go to the lower chunk id even when they
+    straddle the cut, same as a stable full sort, and a row of equal scores
+    (BM25 is mostly zeros) still sorts just k
+    """
+    try:
+        k = operator.index(k)
+    except TypeError:
+        raise ValueError(f"k must be an integer, got {k!r}") from None
+    k = min(max(k, 0), scores.shape[1])
+    if k == 0:
+        return scores[:, :0], np.zeros((scores.shape[0], 0), dtype=np.int64)
+
+    cut = np.argpartition(-scores, k - 1, axis=1)[:, k - 1:k]
+    kth = np.take_along_axis(scores, cut, axis=1)
+    above = scores > kth
+    tied = scores == kth
+    room = k - above.sum(axis=1, keepdims=True)
+    # the first `room` of the ties in each row are its lowest ids
+    chosen = above | (tied & (np.cumsum(tied, axis=1) <= room))
+    rows, ids = np.nonzero(chosen)
+    part = scores[rows, ids]
+    order = np.lexsort((ids, -part, rows))
+    return part[order].reshape(-1, k), ids[order].reshape(-1, k)
+
+
+class DenseIndex:
+    def __init__(self, kind: str = "exact", nlist: Optional[int] = None, nprobe: int = 8, hnsw_m: int = 32, ef_search: int = 64):
+        if kind not in KINDS:
+            raise ValueError(f"unknown dense index kind: {kind}, pick one of {KINDS}")
+        if kind not in SCAN_KINDS and faiss is None:
+            raise ImportError(f"the {kind} backend needs faiss-cpu installed")
+        self.kind = kind
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.vectors: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self.index = None
+
+    def __len__(self) -> int:
+        if self.kind in SCAN_KINDS:
+            return 0 if self.vectors is None else len(self.vectors)
+        return 0 if self.index is None else self.index.ntotal
+
+    @property
+    def nbytes(self) -> int:
+        """
+        memory taken by the stored vectors (faiss: the serialised index)
+        """
+        if self.kind in SCAN_KINDS:
+            return self.vectors.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+        return len(faiss.serialize_index(self.index))
+
+    def build(self, vectors: np.ndarray) -> "DenseIndex":
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, d = vectors.shape
+        if self.kind == "exact":
+            self.vectors = vectors
+        elif self.kind == "float16":
+            self.vectors = vectors.astype(np.float16)
+        elif self.kind == "int8":
+            # symmetric, per dimension: the largest magnitude in each column maps to 127
+            scale = np.abs(vectors).max(axis=0) / 127
+            scale[scale == 0] = 1
+            self.scale = scale.astype(np.float32)
+            self.vectors = np.round(vectors / self.scale).astype(np.int8)
+        elif self.kind == "flat":
+            self.index = faiss.IndexFlatIP(d)
+            self.index.add(vectors)
+        elif self.kind == "ivf":
+            # faiss wants ~39 training points per cluster, so small corpora get few clusters
+            nlist = self.nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+            quantizer = faiss.IndexFlatIP(d)
+            self.index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(vectors)
+            self.index.add(vectors)
+            self.index.nprobe = min(self.nprobe, nlist)
+        elif self.kind == "hnsw":
+            self.index = faiss.IndexHNSWFlat(d, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efSearch = self.ef_search
+            self.index.add(vectors)
+        return self
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `queries` is one vector or a (n_queries, d) matrix.  returns (scores, ids),
+        each (n_queries, k), best first.  faiss pads with id -1 when it finds fewer
+        than k results
+        """
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        if self.kind in SCAN_KINDS:
+            return top_k(self.scores(queries), k)
+        return self.index.search(queries, min(k, self.index.ntotal))
+
+    def scores(self, queries: np.ndarray, ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        (n_queries, n_vectors) similarity of every stored vector, or with `ids`
+        (n_queries, len(ids)) for just those.  the faiss backends only score given
+        ids, from the vectors they reconstruct
+        """
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        if self.kind not in SCAN_KINDS:
+            if ids is None:
+                raise ValueError(f"the {self.kind} backend only does top k search")
+            if self.kind == "ivf":
+                self.index.make_direct_map()
+            return queries @ self.index.reconstruct_batch(np.asarray(ids, dtype=np.int64)).T
+        vectors = self.vectors if ids is None else self.vectors[ids]
+        if self.kind == "exact":
+            return queries @ vectors.T
+        if self.scale is not None:
+            # q . (codes * scale) == (q * scale) . codes
+            queries = queries * self.scale
+        out = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_BLOCK):
+            block = vectors[start:start + SCAN_BLOCK].astype(np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+    def save(self, path: str) -> None:
+        meta = {"kind": self.kind, "nlist": self.nlist, "nprobe": self.nprobe, "hnsw_m": self.hnsw_m, "ef_search": self.ef_search}
+        with open(path + ".json", "w") as f:
+            json.dump(meta, f)
+        if self.kind in SCAN_KINDS:
+            np.save(path + ".npy", self.vectors)
+            if self.scale is not None:
+                np.save(path + "_scale.npy", self.scale)
+        else:
+            faiss.write_index(self.index, path + ".faiss")
+
+    @classmethod
+    def load(cls, path: str) -> "DenseIndex":
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        index = cls(**meta)
+        if index.kind in SCAN_KINDS:
+            index.vectors = np.load(path + ".npy", mmap_mode="r")
+            if index.kind == "int8":
+                index.scale = np.load(path + "_scale.npy")
+        else:
+            index.index = faiss.read_index(path + ".faiss")
+            if index.kind == "ivf":
+                index.index.nprobe = index.nprobe
+            elif index.kind == "hnsw":
+                index.index.hnsw.efSearch = index.ef_search
+        return index
+
+
+def recall_at_k(candidate: DenseIndex, exact: DenseIndex, queries: np.ndarray, k: int) -> float:
+    """
+    share of the true top k (from the exact backend) the candidate also returned
+    """
+    _, truth = exact.search(queries, k)
+    _, found = candidate.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth.tolist(), found.tolist()))
+    return hits / truth.size
+
+
+if __name__ == "__main__":
+    # compare every backend on an existing corpus index, using the chunks
+    # themselves (slightly perturbed) as stand-in queries
+    if len(sys.argv) < 2:
+        raise SystemExit("usage: dense_index.py <corpus index dir> [k]")
+    vectors = np.load(os.path.join(sys.argv[1], "embeddings.npy"))
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), size=min(200, len(vectors)), replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact = DenseIndex("exact").build(vectors)
+    print(f"{'kind':<8}{'MB':>8}{'build ms':>10}{'search ms':>11}{'recall@' + str(k):>11}")
+    for kind in KINDS if faiss is not None else SCAN_KINDS:
+        start = time.perf_counter()
+        index = DenseIndex(kind).build(vectors)
+        built = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        index.search(queries, k)
+        searched = (time.perf_counter() - start) * 1000
+        print(f"{kind:<8}{index.nbytes / 1e6:>8.2f}{built:>10.1f}{searched:>11.1f}{recall_at_k(index, exact, queries, k):>11.3f}")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+"""
+sentence embedding on every core instead of one.  `model.encode` runs in a
+single process, and on a CPU-only box most of the cores sit idle while a big
+corpus is embedded.  an EmbeddingEngine keeps a pool of worker processes that
+each load the model once, when the pool starts:
+
+    with EmbeddingEngine("all-MiniLM-L6-v2", workers=8) as engine:
+        vectors = engine.encode(texts)
+
+inputs are sorted by length and cut into shards of `shard_size` similar-length
+texts, so the batches inside a shard carry little padding.  character length
+stands in for token length: it is free to compute in the parent, which never
+loads the tokenizer, and sorts the texts nearly the same way.  the longest
+shards are submitted first, so one long shard doesn't finish alone at the end.
+`iter_encode` yields (start, vectors) blocks in the original order as soon as
+everything before them is done, and `encode` stacks them.
+
+torch gets `cores // workers` threads per worker so the processes don't fight
+over cores.  workers are spawned rather than forked, because a forked child of
+a process that already ran torch can hang on its thread pool.
+
+`embedder` uses an engine for large batches when EMBED_WORKERS is set (or
+`embedder.use_engine(n)` is called), which covers `embed`, `semantic_chunks`
+and index builds.  `python embed_engine.py test_doc.md --workers 1 2 4` reports
+sentences/sec and speedup for each worker count
+"""
+
+DEFAULT_SHARD_SIZE = 256
+
+_WORKER_MODEL = None
+
+
+def _init_worker(model_name: str, threads: int) -> None:
+    global _WORKER_MODEL
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _WORKER_MODEL = SentenceTransformer(model_name)
+
+
+def _encode_shard(texts: List[str], batch_size: int) -> np.ndarray:
+    vectors = _WORKER_MODEL.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    return np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+
+
+def length_shards(texts: Sequence[str], shard_size: int, length: Callable[[str], int] = len) -> List[np.ndarray]:
+    """
+    positions of `texts` grouped into shards of similar length, longest first
+    """
+    lengths = np.fromiter((length(t) for t in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(-lengths, kind="stable")
+    return [order[i:i + shard_size] for i in range(0, len(order), shard_size)]
+
+
+class EmbeddingEngine:
+    def __init__(
+        self,
+        model_name: str,
+        workers: Optional[int] = None,
+        batch_size: int = 32,
+        shard_size: int = DEFAULT_SHARD_SIZE,
+    ):
+        self.model_name = model_name
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads),
+        )
+
+    def warm_up(self) -> None:
+        """
+        start every worker and load its model, so timings don't include it
+        """
+        list(self.pool.map(_encode_shard, [["warm up"]] * self.workers, [1] * self.workers))
+
+    def iter_encode(self, texts: Sequence[str]) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        (start, vectors) blocks covering `texts` in order.  a block is yielded as
+        soon as it and everything before it is done, not when the last shard is
+        """
+        if not texts:
+            return
+        shards = length_shards(texts, self.shard_size)
+        pending = {
+            self.pool.submit(_encode_shard, [texts[i] for i in shard.tolist()], self.batch_size): shard
+            for shard in shards
+        }
+        out: Optional[np.ndarray] = None
+        done_mask = np.zeros(len(texts), dtype=bool)
+        emitted = 0
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                shard = pending.pop(future)
+                vectors = future.result()
+                if out is None:
+                    out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                out[shard] = vectors
+                done_mask[shard] = True
+            ready = emitted
+            while ready < len(texts) and done_mask[ready]:
+                ready += 1
+            if ready > emitted:
+                yield emitted, out[emitted:ready]
+                emitted = ready
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        blocks = [vectors for _, vectors in self.iter_encode(texts)]
+        return np.vstack(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+    def __enter__(self) -> "EmbeddingEngine":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main() -> int:
+    from embedder import MODEL_NAME
+    from semantic_chunker import sentence_split
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="document whose sentences are embedded")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=1, help="embed the sentences this many times over")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    args = parser.parse_args()
+
+    with open(args.path, "r") as f:
+        sentences = sentence_split(f.read()) * args.repeat
+
+    print(f"{len(sentences)} sentences, {os.cpu_count()} cores")
+    print(f"{'workers':>8}{'seconds':>10}{'sent/s':>10}{'speedup':>9}")
+    base = None
+    for workers in args.workers:
+        with EmbeddingEngine(MODEL_NAME, workers, args.batch_size, args.shard_size) as engine:
+            engine.warm_up()
+            start = time.perf_counter()
+            engine.encode(sentences)
+            elapsed = time.perf_counter() - start
+        rate = len(sentences) / elapsed
+        base = base or rate
+        print(f"{workers:>8}{elapsed:>10.2f}{rate:>10.0f}{rate / base:>8.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
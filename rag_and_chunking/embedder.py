@@ -1,23 +1,93 @@
 #!/usr/bin/env python3
 
 from sentence_transformers import SentenceTransformer
-from typing import cast, List, Union, Tuple
+from typing import cast, List, Optional, Union, Tuple
+from chunk_store import ChunkStore
 from chunker import Chunk
+from embed_engine import EmbeddingEngine
+from embedding_cache import EmbeddingCache
+from tracing import span
+import atexit
+import multiprocessing
 import numpy as np
+import os
 
 # use a sentence embedding model, not our main generation model
 # something like BERT
 # small, fast, bidirectional.  takes input and returns one vector
 
 # for more info see ttps://huggingface.co/sentence-transformers
-model = SentenceTransformer("all-MiniLM-L6-v2")
+MODEL_NAME = "all-MiniLM-L6-v2"
 
+# below this many texts the engine's round trip costs more than it saves
+ENGINE_MIN_TEXTS = 512
 
-def embed(sentences: Union[str, Chunk, List[str], List[Chunk]]) -> np.ndarray:
+_MODEL = None
+_CACHE = None
+_ENGINE = None
+
+
+def _get_model() -> SentenceTransformer:
+    """
+    loaded on first use rather than at import, so anything served from the
+    embedding cache never has to load it at all
+    """
+    global _MODEL
+    if _MODEL is None:
+        _MODEL = SentenceTransformer(MODEL_NAME)
+    return _MODEL
+
+
+def _get_cache() -> Optional[EmbeddingCache]:
+    """
+    set EMBEDDING_CACHE=0 to always go to the model
+    """
+    global _CACHE
+    if os.environ.get("EMBEDDING_CACHE", "1").lower() in ("0", "false"):
+        return None
+    if _CACHE is None:
+        _CACHE = EmbeddingCache(MODEL_NAME, normalize=True)
+    return _CACHE
+
+
+def use_engine(workers: Optional[int] = None) -> EmbeddingEngine:
+    """
+    from now on, encode big batches on a pool of `workers` processes
+    """
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = EmbeddingEngine(MODEL_NAME, workers)
+        atexit.register(_ENGINE.close)
+    return _ENGINE
+
+
+def _get_engine() -> Optional[EmbeddingEngine]:
+    """
+    set EMBED_WORKERS=N (0 for every core) to use an engine.  never inside a
+    worker process, eg ingest's chunking pool, which is already one per core
+    """
+    if _ENGINE is None:
+        workers = os.environ.get("EMBED_WORKERS")
+        if workers is None or multiprocessing.parent_process() is not None:
+            return None
+        use_engine(int(workers) or None)
+    return _ENGINE
+
+
+def _encode(sentences: Union[str, List[str]]) -> np.ndarray:
+    engine = _get_engine()
+    if engine is not None and not isinstance(sentences, str) and len(sentences) >= ENGINE_MIN_TEXTS:
+        return engine.encode(sentences)
+    return _get_model().encode(sentences, normalize_embeddings=True)
+
+
+def embed(sentences: Union[str, Chunk, List[str], List[Chunk], ChunkStore]) -> np.ndarray:
     """
     takes chunks or strings and runs them through the sentence embedding model's encoder
     returns one vector containing all the chunk vectors
     """
+    if isinstance(sentences, ChunkStore):
+        sentences = sentences.texts()
     if isinstance(sentences, list):
         if isinstance(sentences[0], Chunk):
             chunks = cast(list[Chunk], sentences)
@@ -26,15 +96,26 @@ def embed(sentences: Union[str, Chunk, List[str], List[Chunk]]) -> np.ndarray:
     else:
         if isinstance(sentences, Chunk):
             sentences = sentences.txt
-    result = model.encode(sentences, normalize_embeddings=True)
-    return result
+    with span("embed", texts=1 if isinstance(sentences, str) else len(sentences)) as s:
+        cache = _get_cache()
+        if cache is None:
+            return _encode(sentences)
+        hits = cache.hits
+        try:
+            if isinstance(sentences, str):
+                return cache.embed([sentences], _encode)[0]
+            return cache.embed(sentences, _encode)
+        finally:
+            s.count(cache_hits=cache.hits - hits)
 
 
-def best_match(query: str, sentences: Union[List[str], List[Chunk]]) -> List[Tuple[int, float]]:
+def best_match(query: str, sentences: Union[List[str], List[Chunk], ChunkStore]) -> List[Tuple[int, float]]:
     """
     takes a query string and a list of chunks or strings, embeds them into vectors,
     then uses the model's similarity function to pick the highest probability answer
     """
+    if isinstance(sentences, ChunkStore):
+        sentences = sentences.texts()
     if isinstance(sentences, list):
         if isinstance(sentences[0], Chunk):
             chunks = cast(list[Chunk], sentences)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import fcntl
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+"""
+embedding is by far the most expensive CPU step we have, and we keep embedding
+the same text: `best_match` re-embeds every chunk on every query and the
+semantic chunker re-embeds every sentence on every build.
+
+this cache stores vectors in a memory-mapped float32 matrix (one row per text)
+with a small json index mapping text hash -> row.  there is one cache per
+(model name, normalisation flag) so vectors from different models never mix.
+lookups that hit never touch the model; misses are encoded in one batch.
+
+when the cache is full, the least recently used rows are reused.
+
+several processes (eg ingest's chunking pool) can share one cache.  every read
+and write of the matrix happens under an exclusive `flock` on `lock`, after
+catching up on what the other processes did, and the model runs outside it.
+new rows and the ticks of hits are appended to `entries.log` ("hash slot
+tick" lines) instead of rewriting the whole index, and the log is folded back
+into index.json once it passes `COMPACT_LOG_LINES` (or on `flush`).  free rows
+are kept in a list and the LRU order in an OrderedDict, so storing a batch
+never scans the whole matrix
+"""
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag_and_chunking", "embeddings")
+DEFAULT_MAX_ENTRIES = 200_000  # ~300MB of float32 rows for MiniLM
+COMPACT_LOG_LINES = 50_000  # fold the log into index.json past this many lines
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        model_name: str,
+        normalize: bool = True,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        safe_name = model_name.replace("/", "__")
+        self.dir = os.path.join(cache_dir, f"{safe_name}-{'norm' if normalize else 'raw'}")
+        self.max_entries = max_entries
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.log_path = os.path.join(self.dir, "entries.log")
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.lock_path = os.path.join(self.dir, "lock")
+
+        self.dim: Optional[int] = None
+        self.capacity = 0
+        self.slots: Dict[str, int] = {}    # text hash -> row in the matrix
+        self.owners: Dict[int, str] = {}   # row -> text hash, to drop rows another process reused
+        self.ticks: "OrderedDict[str, int]" = OrderedDict()  # text hash -> last use, oldest first
+        self.free: List[int] = []          # rows nobody owns (may hold stale ones, `_grow` skips them)
+        self.clock = 0
+        self.vectors: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        # what of the on-disk state we've already applied
+        self._index_id: Optional[tuple] = None
+        self._log_offset = 0
+        self._log_lines = 0
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self._sync()
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _set(self, h: str, slot: int, tick: int) -> None:
+        old = self.owners.get(slot)
+        if old is not None and old != h:
+            del self.slots[old]
+            self.ticks.pop(old, None)
+        previous = self.slots.get(h)
+        if previous is not None and previous != slot:
+            self.owners.pop(previous, None)
+            self.free.append(previous)
+        self.slots[h] = slot
+        self.owners[slot] = h
+        # ticks are handed out and logged under the lock, so they arrive in order
+        if tick >= self.ticks.get(h, -1):
+            self.ticks[h] = tick
+            self.ticks.move_to_end(h)
+        self.clock = max(self.clock, tick)
+
+    def _sync(self) -> None:
+        """
+        catches up with the files: reloads index.json if another process
+        rewrote it, then applies the log lines we haven't seen yet.  lock held
+        """
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        index_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        reloaded = index_id != self._index_id
+        if reloaded:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.slots, self.owners, self.ticks = {}, {}, OrderedDict()
+            self.clock = max(self.clock, index["clock"])
+            for h, (slot, tick) in sorted(index["entries"].items(), key=lambda e: e[1][1]):
+                self._set(h, slot, tick)
+            self._index_id = index_id
+            self._log_offset = 0
+            self._log_lines = 0
+
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                f.seek(self._log_offset)
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # never happens under the lock, but don't apply half a line
+                    h, slot, tick = line.split()
+                    self._set(h, int(slot), int(tick))
+                    self._log_offset += len(line)
+                    self._log_lines += 1
+
+        capacity = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        if capacity != self.capacity or self.vectors is None:
+            self._map(capacity)
+        if reloaded:
+            self.free = [s for s in range(self.capacity - 1, -1, -1) if s not in self.owners]
+
+    def _map(self, capacity: int) -> None:
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+        self.vectors = None
+        if capacity:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _write_index(self) -> None:
+        """
+        rewrites index.json from what we know (just synced) and empties the log.
+        lock held
+        """
+        index = {
+            "dim": self.dim,
+            "capacity": self.capacity,
+            "clock": self.clock,
+            "entries": {h: [self.slots[h], tick] for h, tick in self.ticks.items()},
+        }
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+        open(self.log_path, "w").close()
+        st = os.stat(self.index_path)
+        self._index_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self._log_offset = 0
+        self._log_lines = 0
+
+    def flush(self) -> None:
+        """
+        folds the log into index.json now rather than at `COMPACT_LOG_LINES`
+        """
+        if self.dim is None:
+            return
+        with self._locked():
+            if self.vectors is not None:
+                self.vectors.flush()
+            self._write_index()
+
+    def _grow(self, needed: int) -> List[int]:
+        """
+        hands out `needed` free rows, growing the file (doubling, up to
+        `max_entries`) and then evicting least recently used rows if that's
+        still not enough.  lock held
+        """
+        if self.capacity - len(self.slots) < needed:
+            new_capacity = min(max(self.capacity * 2, len(self.slots) + needed, 1024), self.max_entries)
+            if new_capacity > self.capacity:
+                with open(self.vectors_path, "ab") as f:
+                    f.truncate(new_capacity * self.dim * 4)
+                self._map(new_capacity)
+
+        rows: List[int] = []
+        taken = set()
+        while self.free and len(rows) < needed:
+            slot = self.free.pop()
+            if slot not in self.owners and slot not in taken:
+                rows.append(slot)
+                taken.add(slot)
+        while len(rows) < needed:
+            h, _ = self.ticks.popitem(last=False)
+            slot = self.slots.pop(h)
+            del self.owners[slot]
+            rows.append(slot)
+        return rows
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        returns a (len(texts), dim) matrix.  `encode` is only called once, with the
+        distinct texts that weren't already cached
+        """
+        hashes = [text_hash(t) for t in texts]
+
+        hit_rows: List[int] = []
+        hit_slots: List[int] = []
+        missing: Dict[str, str] = {}
+        with self._locked():
+            self.clock += 1
+            touched: Dict[str, int] = {}
+            for i, (h, t) in enumerate(zip(hashes, texts)):
+                slot = self.slots.get(h)
+                if slot is None:
+                    missing.setdefault(h, t)
+                else:
+                    touched[h] = slot
+                    hit_rows.append(i)
+                    hit_slots.append(slot)
+            # copied out under the lock, another process may reuse the rows later
+            hit_vectors = np.array(self.vectors[hit_slots]) if hit_slots else None
+            # the new ticks go in the log too, so the LRU order survives without a flush
+            self._append_log([(h, slot, self.clock) for h, slot in touched.items()])
+        self.hits += len(hit_rows)
+        self.misses += len(missing)
+
+        if not missing:
+            return hit_vectors
+
+        encoded = np.asarray(encode(list(missing.values())), dtype=np.float32)
+        dim = encoded.shape[1]
+        out = np.empty((len(texts), dim), dtype=np.float32)
+        if hit_rows:
+            out[hit_rows] = hit_vectors
+        position = {h: j for j, h in enumerate(missing)}
+        miss_rows = [i for i, h in enumerate(hashes) if h in position]
+        out[miss_rows] = encoded[[position[hashes[i]] for i in miss_rows]]
+
+        with self._locked():
+            if self.dim is None:
+                self.dim = dim
+                self._write_index()
+            self.clock += 1
+            # another process may have stored some of these meanwhile.  a single
+            # call bigger than the whole cache can't all be kept, but is still returned
+            to_store = [h for h in missing if h not in self.slots][: self.max_entries]
+            slots = self._grow(len(to_store))
+            for h, slot in zip(to_store, slots):
+                self.vectors[slot] = encoded[position[h]]
+            self.vectors.flush()
+            # the vectors are on disk before the log says where they are
+            self._append_log([(h, slot, self.clock) for h, slot in zip(to_store, slots)])
+        return out
+
+    def _append_log(self, entries: List[Tuple[str, int, int]]) -> None:
+        """
+        applies (hash, slot, tick) entries and appends them to the log,
+        compacting it once it's long enough.  lock held
+        """
+        if not entries:
+            return
+        for h, slot, tick in entries:
+            self._set(h, slot, tick)
+        with open(self.log_path, "a") as f:
+            f.write("".join(f"{h} {slot} {tick}\n" for h, slot, tick in entries))
+        self._log_offset = os.path.getsize(self.log_path)
+        self._log_lines += len(entries)
+        if self._log_lines > COMPACT_LOG_LINES:
+            self._write_index()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
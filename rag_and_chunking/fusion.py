@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+from typing import Tuple
+
+import numpy as np
+
+from dense_index import top_k
+
+"""
+combining dense and BM25 scores.  everything here works on numpy arrays of
+scores indexed by chunk id: one query is a (n_chunks,) vector, a batch of
+queries is a (n_queries, n_chunks) matrix, and normalisation always runs along
+the last axis so each query is normalised on its own.
+
+methods:
+    linear  alpha * dense + (1 - alpha) * bm25, after normalising both with
+            one of NORMALISERS.  alpha = 1 is pure dense, 0 is pure BM25
+    rrf     reciprocal rank fusion, sum of 1 / (rrf_k + rank) over both lists.
+            only uses the rank order, so it needs no normalisation at all
+
+`fuse_top_k` returns just the best k per query via argpartition
+"""
+
+METHODS = ("linear", "rrf")
+RRF_K = 60
+
+
+def _max(scores: np.ndarray) -> np.ndarray:
+    # what get_hybrid always did: divide by the best score, all zeros if that isn't positive
+    m = scores.max(axis=-1, keepdims=True)
+    return np.divide(scores, m, out=np.zeros_like(scores), where=m > 0)
+
+
+def _minmax(scores: np.ndarray) -> np.ndarray:
+    low = scores.min(axis=-1, keepdims=True)
+    spread = scores.max(axis=-1, keepdims=True) - low
+    return np.divide(scores - low, spread, out=np.zeros_like(scores), where=spread > 0)
+
+
+def _zscore(scores: np.ndarray) -> np.ndarray:
+    std = scores.std(axis=-1, keepdims=True)
+    return np.divide(scores - scores.mean(axis=-1, keepdims=True), std, out=np.zeros_like(scores), where=std > 0)
+
+
+NORMALISERS = {
+    "max": _max,
+    "minmax": _minmax,
+    "zscore": _zscore,
+    "none": lambda scores: scores,
+}
+
+
+def normalise(scores: np.ndarray, method: str = "max") -> np.ndarray:
+    if method not in NORMALISERS:
+        raise ValueError(f"unknown normalisation: {method}, pick one of {tuple(NORMALISERS)}")
+    return NORMALISERS[method](np.asarray(scores, dtype=np.float64))
+
+
+def ranks(scores: np.ndarray) -> np.ndarray:
+    """
+    1-based rank of every chunk, best first, ties broken by chunk id
+    """
+    order = np.argsort(-scores, axis=-1, kind="stable")
+    result = np.empty_like(order)
+    np.put_along_axis(result, order, np.arange(1, scores.shape[-1] + 1), axis=-1)
+    return result
+
+
+def fuse(
+    dense: np.ndarray,
+    sparse: np.ndarray,
+    method: str = "linear",
+    alpha: float = 0.5,
+    norm: str = "max",
+    rrf_k: int = RRF_K,
+) -> np.ndarray:
+    """
+    one fused score per chunk (per query), same shape as the inputs
+    """
+    dense = np.asarray(dense, dtype=np.float64)
+    sparse = np.asarray(sparse, dtype=np.float64)
+    if dense.shape != sparse.shape:
+        raise ValueError(f"dense scores {dense.shape} and BM25 scores {sparse.shape} don't line up")
+    if method == "linear":
+        return alpha * normalise(dense, norm) + (1 - alpha) * normalise(sparse, norm)
+    if method == "rrf":
+        return 1.0 / (rrf_k + ranks(dense)) + 1.0 / (rrf_k + ranks(sparse))
+    raise ValueError(f"unknown fusion method: {method}, pick one of {METHODS}")
+
+
+def fuse_top_k(dense: np.ndarray, sparse: np.ndarray, k: int, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (scores, chunk ids), each (n_queries, k), best first.  a single query's
+    vectors come back as 1-row matrices.  `kwargs` go to `fuse`
+    """
+    return top_k(np.atleast_2d(fuse(dense, sparse, **kwargs)), k)
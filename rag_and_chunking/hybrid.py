@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 from chunker import Chunk
+from dense_index import top_k
+from tracing import span
+from collections import Counter
 from math import log
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+import json
+import numpy as np
+import os
 import re
 
 """
@@ -68,3 +74,187 @@ def inverse_document_frequency(term: str, chunks: List[Chunk]) -> float:
     )
 
 
+K1 = 1.2  # saturation parameter.  term frequency saturation
+B = 0.75  # length normalisation
+
+
+class BM25Index:
+    """
+    everything BM25 needs, computed once instead of on every query:
+        term -> id, and per term a postings list of (chunk id, term frequency)
+        document frequency and IDF per term
+        token count per chunk, and the average over all chunks
+    scoring a query only walks the postings of the query's own terms, so a term
+    that appears in 3 chunks costs 3 additions no matter how big the corpus is.
+    new chunks can be added later; IDF and avgdl are refreshed when that happens
+    """
+
+    def __init__(self, chunks: Optional[List[Chunk]] = None, k1: float = K1, b: float = B):
+        self.k1 = k1
+        self.b = b
+        self.term_ids: Dict[str, int] = {}
+        self._post_docs: List[np.ndarray] = []
+        self._post_tfs: List[np.ndarray] = []
+        self._df = np.zeros(0, dtype=np.int64)
+        self._doc_lens = np.zeros(0, dtype=np.int64)
+        # added since the last `_finalise`: new postings of the touched terms only
+        self._pending: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._pending_lens: List[int] = []
+        self._stats: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self.add(chunks or [])
+
+    def __len__(self) -> int:
+        return len(self._doc_lens) + len(self._pending_lens)
+
+    def add(self, chunks: List[Chunk]) -> None:
+        for chunk in chunks:
+            self.add_tokens(tokenize_chunk(chunk))
+
+    def add_tokens(self, tokens: List[str]) -> None:
+        doc_id = len(self)
+        self._pending_lens.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.term_ids)
+            docs, tfs = self._pending.setdefault(term_id, ([], []))
+            docs.append(doc_id)
+            tfs.append(tf)
+        self._stats = None
+
+    def _finalise(self) -> Tuple[List[np.ndarray], List[np.ndarray], np.ndarray, np.ndarray]:
+        """
+        the postings as numpy arrays plus the IDF of every term and the length
+        norm of every chunk.  after an `add`, only the postings of the terms it
+        touched are rebuilt; IDF and length norms are one vectorised pass over
+        the document frequencies and chunk lengths
+        """
+        if self._stats is None:
+            if len(self.term_ids) > len(self._post_docs):
+                new_terms = len(self.term_ids) - len(self._post_docs)
+                self._post_docs += [np.zeros(0, dtype=np.int32) for _ in range(new_terms)]
+                self._post_tfs += [np.zeros(0, dtype=np.int32) for _ in range(new_terms)]
+                self._df = np.concatenate([self._df, np.zeros(new_terms, dtype=np.int64)])
+            for term_id, (docs, tfs) in self._pending.items():
+                # loaded postings are read-only memory-mapped slices, this copies them once
+                self._post_docs[term_id] = np.concatenate([self._post_docs[term_id], np.asarray(docs, dtype=np.int32)])
+                self._post_tfs[term_id] = np.concatenate([self._post_tfs[term_id], np.asarray(tfs, dtype=np.int32)])
+                self._df[term_id] += len(docs)
+            self._doc_lens = np.concatenate([self._doc_lens, np.asarray(self._pending_lens, dtype=np.int64)])
+            self._pending, self._pending_lens = {}, []
+
+            n = len(self._doc_lens)
+            idf = np.log((n - self._df + 0.5) / (self._df + 0.5) + 1)
+            avgdl = self._doc_lens.mean() if n else 0.0
+            if avgdl:
+                length_norm = self.k1 * (1 - self.b + self.b * (self._doc_lens / avgdl))
+            else:
+                length_norm = np.full(n, self.k1)
+            self._stats = (idf, length_norm)
+        return (self._post_docs, self._post_tfs) + self._stats
+
+    @property
+    def avgdl(self) -> float:
+        self._finalise()
+        return float(self._doc_lens.mean()) if len(self._doc_lens) else 0.0
+
+    def idf(self, term: str) -> float:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0.0
+        return float(self._finalise()[2][term_id])
+
+    def score(self, query_tokens: List[str]) -> np.ndarray:
+        """
+        BM25 score of every chunk for the query, indexed by chunk id
+        """
+        with span("bm25_score", terms=len(query_tokens), chunks=len(self)):
+            return self._score(query_tokens)
+
+    def _score(self, query_tokens: List[str]) -> np.ndarray:
+        docs, tfs, idf, length_norm = self._finalise()
+        scores = np.zeros(len(self), dtype=np.float64)
+        for term in set(query_tokens):  # use a set to prevent repeating terms being over-weighted!
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            d, tf = docs[term_id], tfs[term_id]
+            # chunk ids are unique within a postings list, so plain fancy-index += is safe
+            scores[d] += idf[term_id] * (tf * (self.k1 + 1)) / (tf + length_norm[d])
+        return scores
+
+    def top_candidates(self, query_tokens: List[str], n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (chunk ids, scores) of the `n` best chunks, best first.  only the postings
+        of the query's terms are touched, never a (n_chunks,) array, so the cost
+        follows how common the terms are rather than the corpus size.  chunks that
+        share no term with the query are never candidates
+        """
+        docs, tfs, idf, length_norm = self._finalise()
+        ids, parts = [], []
+        for term in set(query_tokens):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            d, tf = docs[term_id], tfs[term_id]
+            ids.append(d)
+            parts.append(idf[term_id] * (tf * (self.k1 + 1)) / (tf + length_norm[d]))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        # a chunk matching several terms shows up once per term, sum them up
+        unique, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(parts))
+        best, order = top_k(scores[np.newaxis], n)
+        return unique[order[0]].astype(np.int64), best[0]
+
+    def score_batch(self, queries_tokens: List[List[str]]) -> np.ndarray:
+        """
+        (n_queries, n_chunks) matrix of `score` rows, to line up with a batch of dense scores
+        """
+        scores = np.zeros((len(queries_tokens), len(self)), dtype=np.float64)
+        for row, query_tokens in zip(scores, queries_tokens):
+            row += self.score(query_tokens)
+        return scores
+
+    def save(self, directory: str) -> None:
+        """
+        flattens the postings CSR-style (one offsets array, one big array each of
+        chunk ids and term frequencies) so they can be memory-mapped back in
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._finalise()
+        lengths = [len(d) for d in self._post_docs]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        flat_docs = np.concatenate([np.asarray(d, dtype=np.int32) for d in self._post_docs] or [np.zeros(0, np.int32)])
+        flat_tfs = np.concatenate([np.asarray(t, dtype=np.int32) for t in self._post_tfs] or [np.zeros(0, np.int32)])
+        np.save(os.path.join(directory, "bm25_offsets.npy"), offsets)
+        np.save(os.path.join(directory, "bm25_docs.npy"), flat_docs)
+        np.save(os.path.join(directory, "bm25_tfs.npy"), flat_tfs)
+        np.save(os.path.join(directory, "bm25_doc_lens.npy"), self._doc_lens.astype(np.int32))
+        terms = sorted(self.term_ids, key=self.term_ids.__getitem__)
+        with open(os.path.join(directory, "bm25_terms.json"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": terms}, f)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        """
+        the loaded postings are slices of memory-mapped arrays.  a postings list
+        is only copied if `add` later appends to it
+        """
+        with open(os.path.join(directory, "bm25_terms.json")) as f:
+            meta = json.load(f)
+        offsets = np.load(os.path.join(directory, "bm25_offsets.npy"))
+        flat_docs = np.load(os.path.join(directory, "bm25_docs.npy"), mmap_mode="r")
+        flat_tfs = np.load(os.path.join(directory, "bm25_tfs.npy"), mmap_mode="r")
+        doc_lens = np.load(os.path.join(directory, "bm25_doc_lens.npy"))
+
+        index = cls(k1=meta["k1"], b=meta["b"])
+        index.term_ids = {term: i for i, term in enumerate(meta["terms"])}
+        index._doc_lens = doc_lens.astype(np.int64)
+        index._df = np.diff(offsets).astype(np.int64)
+        spans = list(zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+        index._post_docs = [flat_docs[start:end] for start, end in spans]
+        index._post_tfs = [flat_tfs[start:end] for start, end in spans]
+        return index
+
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+from chunker import Chunk
+from concurrent.futures import ProcessPoolExecutor
+from corpus_index import INDEX_VERSION, file_hash, make_chunks, write_index
+from typing import Dict, List, Optional, Tuple
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+
+"""
+ingests a whole directory tree instead of the single file `load_test_data`
+reads.  each file is chunked with the chosen chunker in a process pool, and
+every chunk's meta records where it came from:
+
+    doc_id          stable id for the file (hash of its path relative to the root)
+    path            that relative path
+    byte_start/end  the span of the file the chunk was taken from
+    content_hash    sha256 of the file when it was chunked
+
+chunks are kept per document in `<out>/docs/<doc_id>.json`, and `<out>/state.json`
+remembers each file's size, mtime and hash.  on the next run a file is only
+re-chunked if its hash changed (and only re-hashed if its size or mtime did),
+and documents whose files disappeared are dropped.  `--build-index` then
+assembles every document's chunks into one corpus index; thanks to the
+embedding cache only the chunks that actually changed get embedded again
+
+    python ingest.py docs/ --out docs.ingest --chunker structure --build-index
+"""
+
+DEFAULT_PATTERNS = ["*.md", "*.txt", "*.html"]
+STATE_FILE = "state.json"
+
+
+def doc_id_for(rel_path: str) -> str:
+    return hashlib.sha1(rel_path.encode()).hexdigest()[:16]
+
+
+def walk(root: str, patterns: List[str]) -> List[str]:
+    """
+    relative paths of matching files, sorted so chunk order is stable between runs
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in filenames:
+            if any(fnmatch.fnmatch(name, p) for p in patterns):
+                found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(found)
+
+
+def byte_offsets(text: str, char_offsets: List[int]) -> Dict[int, int]:
+    """
+    character offset -> utf-8 byte offset, encoding each stretch of text between
+    consecutive offsets once rather than re-encoding a prefix per chunk
+    """
+    result: Dict[int, int] = {}
+    pos = 0
+    byte_pos = 0
+    for offset in sorted(set(char_offsets)):
+        byte_pos += len(text[pos:offset].encode("utf-8", "surrogateescape"))
+        pos = offset
+        result[offset] = byte_pos
+    return result
+
+
+def _init_worker() -> None:
+    # each worker would embed through the one shared on-disk embedding cache at
+    # the same time; chunking doesn't need it, and the parent embeds the index
+    os.environ["EMBEDDING_CACHE"] = "0"
+
+
+def chunk_file(root: str, rel_path: str, chunker: Dict, content_hash: str) -> Dict:
+    """
+    runs in a worker process.  returns a plain dict so it pickles cheaply
+    """
+    # bytes in, no newline translation, undecodable bytes kept as surrogates: the
+    # text has exactly one character per byte sequence of the file, so offsets
+    # into it map back to the file's bytes
+    with open(os.path.join(root, rel_path), "rb") as f:
+        text = f.read().decode("utf-8", "surrogateescape")
+
+    chunks = make_chunks(text, chunker)
+    offsets = byte_offsets(text, [c.meta[k] for c in chunks for k in ("start", "end") if k in c.meta])
+    doc_id = doc_id_for(rel_path)
+    records = []
+    for c in chunks:
+        meta = {"doc_id": doc_id, "path": rel_path, "content_hash": content_hash}
+        if "start" in c.meta:
+            meta["byte_start"] = offsets[c.meta["start"]]
+            meta["byte_end"] = offsets[c.meta["end"]]
+        # the stored text swaps undecodable bytes for U+FFFD, the offsets stay exact
+        txt = c.txt.encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+        records.append({"txt": txt, "meta": meta})
+    return {"doc_id": doc_id, "path": rel_path, "chunks": records}
+
+
+class Ingestor:
+    def __init__(self, root: str, out_dir: str, chunker: Dict, patterns: Optional[List[str]] = None, workers: Optional[int] = None):
+        self.root = root
+        self.out_dir = out_dir
+        self.docs_dir = os.path.join(out_dir, "docs")
+        self.chunker = chunker
+        self.patterns = patterns or DEFAULT_PATTERNS
+        self.workers = workers
+        self.state_path = os.path.join(out_dir, STATE_FILE)
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {"chunker": self.chunker, "files": {}}
+        if state.get("chunker") != self.chunker:
+            # different chunker settings invalidate every document
+            return {"chunker": self.chunker, "files": {}}
+        return state
+
+    def save_state(self, state: Dict) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def plan(self, state: Dict) -> Tuple[List[Tuple[str, str]], List[str], Dict]:
+        """
+        works out which files need chunking: (rel path, new hash) pairs, the
+        rel paths that disappeared, and the file entries for the next state
+        """
+        previous = state["files"]
+        changed: List[Tuple[str, str]] = []
+        files: Dict[str, Dict] = {}
+        for rel in walk(self.root, self.patterns):
+            st = os.stat(os.path.join(self.root, rel))
+            old = previous.get(rel)
+            if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime:
+                files[rel] = old
+                continue
+            digest = file_hash(os.path.join(self.root, rel))
+            files[rel] = {"size": st.st_size, "mtime": st.st_mtime, "hash": digest, "doc_id": doc_id_for(rel)}
+            if not old or old["hash"] != digest:
+                changed.append((rel, digest))
+        removed = [rel for rel in previous if rel not in files]
+        return changed, removed, files
+
+    def run(self) -> Dict:
+        os.makedirs(self.docs_dir, exist_ok=True)
+        state = self.load_state()
+        changed, removed, files = self.plan(state)
+
+        for rel in removed:
+            try:
+                os.remove(os.path.join(self.docs_dir, f"{state['files'][rel]['doc_id']}.json"))
+            except OSError:
+                pass
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(chunk_file, self.root, rel, self.chunker, digest) for rel, digest in changed]
+            for future in futures:
+                doc = future.result()
+                with open(os.path.join(self.docs_dir, f"{doc['doc_id']}.json"), "w") as f:
+                    json.dump(doc, f)
+                files[doc["path"]]["n_chunks"] = len(doc["chunks"])
+                print(f"chunked {doc['path']}: {len(doc['chunks'])} chunks")
+
+        self.save_state({"chunker": self.chunker, "files": files})
+        return {"files": len(files), "changed": len(changed), "removed": len(removed)}
+
+    def chunks(self) -> List[Chunk]:
+        """
+        every document's chunks, in path order
+        """
+        with open(self.state_path) as f:
+            files = json.load(f)["files"]
+        chunks: List[Chunk] = []
+        for rel in sorted(files):
+            with open(os.path.join(self.docs_dir, f"{files[rel]['doc_id']}.json")) as f:
+                chunks += [Chunk(txt=c["txt"], meta=c["meta"]) for c in json.load(f)["chunks"]]
+        return chunks
+
+    def tree_hash(self) -> str:
+        with open(self.state_path) as f:
+            files = json.load(f)["files"]
+        return hashlib.sha256(json.dumps({rel: files[rel]["hash"] for rel in sorted(files)}).encode()).hexdigest()
+
+
+def index_is_stale(index_dir: str, tree_hash: str, chunker: Dict) -> bool:
+    """
+    the index was built from a different tree (or chunker) than the one just
+    ingested, including by an earlier run that didn't pass --build-index
+    """
+    try:
+        with open(os.path.join(index_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return True
+    return (
+        manifest.get("version") != INDEX_VERSION
+        or manifest.get("source_hash") != tree_hash
+        or manifest.get("chunker") != chunker
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", type=str)
+    parser.add_argument("--out", type=str, help="defaults to <root>.ingest")
+    parser.add_argument("--chunker", choices=["semantic", "structure", "fixed"], default="semantic")
+    parser.add_argument("--threshold", type=float, default=0.75, help="semantic chunker similarity threshold")
+    parser.add_argument("--size", type=int, default=512, help="fixed chunk size in characters")
+    parser.add_argument("--overlap", type=int, default=64, help="fixed chunk overlap in characters")
+    parser.add_argument("--pattern", action="append", help="file name glob, repeatable")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--build-index", action="store_true", help="also write a corpus index of every chunk")
+    parser.add_argument("--embed-workers", type=int, help="embed the index on this many processes (0: every core)")
+    args = parser.parse_args()
+
+    chunker: Dict = {"name": args.chunker}
+    if args.chunker == "semantic":
+        chunker["threshold"] = args.threshold
+    elif args.chunker == "fixed":
+        chunker.update(size=args.size, overlap=args.overlap)
+
+    out_dir = args.out or args.root.rstrip("/") + ".ingest"
+    ingestor = Ingestor(args.root, out_dir, chunker, args.pattern, args.workers)
+    summary = ingestor.run()
+    print(f"{summary['files']} files, {summary['changed']} re-chunked, {summary['removed']} removed")
+
+    if args.build_index and index_is_stale(os.path.join(out_dir, "index"), ingestor.tree_hash(), chunker):
+        if args.embed_workers is not None:
+            import embedder
+            embedder.use_engine(args.embed_workers or None)
+        index = write_index(os.path.join(out_dir, "index"), ingestor.chunks(), {
+            "source": os.path.abspath(args.root),
+            "source_hash": ingestor.tree_hash(),
+            "chunker": chunker,
+        })
+        print(f"indexed {len(index)} chunks into {index.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import re
+import threading
+import time
+
+import numpy as np
+
+"""
+results of recent queries, so a repeated question doesn't get ranked again.
+users ask the same thing in slightly different words, so a lookup tries two
+things:
+
+    exact       the normalised query (casefolded, punctuation and spacing
+                dropped, any script) was seen before.  this is checked before
+                the query is embedded, so a hit skips that too.  a query that
+                normalises to nothing (all punctuation) never matches exactly
+    semantic    the query's vector has cosine similarity >= `threshold` with the
+                vector of a cached query.  vectors are normalised, so that's one
+                (n_entries, d) x (d,) product
+
+an entry holds the ranked (chunk id, score) list and, once the caller has built
+it, the packed context.  results depend on the retrieval settings (k, fusion,
+depth, budget...), so those are part of the key and a lookup only matches
+entries made with the same settings.  entries belong to one index version
+(`CorpusIndex.version`); asking with a different version drops the lot.
+
+eviction is least recently used once `max_entries` is reached, and entries
+older than `ttl_s` (if set) are dropped when they're next looked at.  `stats()`
+reports exact/semantic hits, misses, evictions, expiries and the hit rate
+"""
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 1024
+
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalise_query(query: str) -> str:
+    return " ".join(WORD_RE.findall(query.casefold()))
+
+
+def settings_key(settings: Optional[Dict]) -> str:
+    return json.dumps(settings or {}, sort_keys=True)
+
+
+class CachedResult:
+    __slots__ = ("query", "settings", "ranked", "context", "slot", "created")
+
+    def __init__(self, query: str, settings: str, ranked: List[Tuple[int, float]], context: Optional[str], slot: int, created: float):
+        self.query = query
+        self.settings = settings
+        self.ranked = ranked
+        self.context = context
+        self.slot = slot
+        self.created = created
+
+
+class QueryCache:
+    def __init__(
+        self,
+        threshold: Optional[float] = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_s: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        `threshold` None turns off semantic matching, leaving exact matches only
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self.version: Optional[str] = None
+        self.entries: "OrderedDict[Tuple[str, str], CachedResult]" = OrderedDict()
+        # one row per slot; `owners` says which entry a row belongs to (None = free)
+        self.vectors: Optional[np.ndarray] = None
+        self.owners: List[Optional[Tuple[str, str]]] = []
+        self.free: List[int] = []
+        self._reset()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _reset(self) -> None:
+        self.entries.clear()
+        self.owners = [None] * self.max_entries
+        self.free = list(range(self.max_entries - 1, -1, -1))
+
+    def _check_version(self, version: str) -> None:
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self._reset()
+            self.version = version
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        entry = self.entries.pop(key)
+        self.owners[entry.slot] = None
+        self.free.append(entry.slot)
+
+    def _alive(self, key: Tuple[str, str], entry: CachedResult) -> bool:
+        if self.ttl_s is not None and self.clock() - entry.created > self.ttl_s:
+            self._drop(key)
+            self.expired += 1
+            return False
+        return True
+
+    def get(self, query: str, version: str, settings: Optional[Dict] = None) -> Optional[CachedResult]:
+        """
+        exact match only, needs no query vector.  a miss here isn't counted yet,
+        `get_similar` decides that
+        """
+        key = (normalise_query(query), settings_key(settings))
+        with self._lock:
+            self._check_version(version)
+            if not key[0]:
+                return None
+            entry = self.entries.get(key)
+            if entry is None or not self._alive(key, entry):
+                return None
+            self.entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry
+
+    def get_similar(self, vector: np.ndarray, version: str, settings: Optional[Dict] = None) -> Optional[CachedResult]:
+        """
+        the most similar cached query with the same settings, if it's at least
+        `threshold` similar.  counts a miss otherwise
+        """
+        settings = settings_key(settings)
+        with self._lock:
+            self._check_version(version)
+            if self.threshold is None or self.vectors is None or not self.entries:
+                self.misses += 1
+                return None
+            slots = [e.slot for e in self.entries.values() if e.settings == settings]
+            if slots:
+                sims = self.vectors[slots] @ np.ravel(vector).astype(np.float32)
+                close = np.nonzero(sims >= self.threshold)[0]
+                # most similar first; an expired one is dropped and the next one tried
+                for i in close[np.argsort(-sims[close], kind="stable")].tolist():
+                    key = self.owners[slots[i]]
+                    entry = self.entries[key]
+                    if self._alive(key, entry):
+                        self.entries.move_to_end(key)
+                        self.semantic_hits += 1
+                        return entry
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        query: str,
+        version: str,
+        vector: np.ndarray,
+        ranked: List[Tuple[int, float]],
+        settings: Optional[Dict] = None,
+        context: Optional[str] = None,
+    ) -> CachedResult:
+        vector = np.ravel(vector).astype(np.float32)
+        key = (normalise_query(query), settings_key(settings))
+        with self._lock:
+            self._check_version(version)
+            if self.vectors is None or self.vectors.shape[1] != len(vector):
+                # a different embedding model: old entries' vectors can't be compared any more
+                if self.entries:
+                    self.invalidations += 1
+                self._reset()
+                self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            if key in self.entries:
+                self._drop(key)
+            if not self.free:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+            slot = self.free.pop()
+            self.vectors[slot] = vector
+            self.owners[slot] = key
+            entry = self.entries[key] = CachedResult(key[0], key[1], ranked, context, slot, self.clock())
+            return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def stats(self) -> Dict:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+        }
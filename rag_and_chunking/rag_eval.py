@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+# decoder_params' modules import each other by bare name, and are only ever
+# imported that way here, so each loads once
+sys.path.append(str(Path(__file__).resolve().parents[1] / "decoder_params"))
+
+from context_budgeting import TOKENIZER_NAME, get_tokens, top_n
+from corpus_index import CorpusIndex, load_or_build
+from inference_tests import run_pixi_generate
+from modelreport import ModelReport
+from query_cache import DEFAULT_THRESHOLD, QueryCache, normalise_query
+from results_store import ResultsStore
+from server_backend import DEFAULT_SERVER_URL, ServerClient, run_server_generate
+from tester import rank_hybrid_batch
+from tracing import span
+
+"""
+RAG over a whole file of queries instead of one query per process:
+
+    python rag_eval.py queries.txt --index test_doc.md --concurrency 8 --out rag_eval.jsonl
+
+the queries file is one query per line, or a query set json like
+bench_queries.json.  every query is embedded up front in one batch, then a
+producer ranks (vectorised, `--retrieve-batch` queries per fusion) and packs
+contexts on a worker thread and hands prompts over a bounded queue to
+`--concurrency` generation workers.  retrieval for the next batch runs while
+generations are in flight, and the queue bound keeps it from running far ahead.
+
+one line per query goes to `--out`: the ModelReport fields plus
+
+    query_id, query     which query this was
+    retrieved           chunk ids in rank order, as packed into the context
+    retrieval_ms        this query's share of its batch's rank + pack time
+    queue_ms            packed prompt waiting for a free generation worker
+    generation_ms       wall time of the generation call
+
+`--store` also appends each report (tagged the same way) to a ResultsStore.
+`--query-cache` reuses the ranking and packed context of a query already seen
+in this run, word for word or by embedding similarity (see query_cache.py).
+the pixi backend starts a process per prompt, so it runs one at a time
+"""
+
+PROMPT = """
+Answer the question using ONLY the context below.
+If the answer is not explicitly stated, say "I don't know."
+
+CONTEXT:
+<rag_token>
+
+QUESTION:
+<question_token>"""
+
+
+def read_queries(path: str) -> List[str]:
+    with open(path, "r") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        return [q["query"] for q in json.loads(text)["queries"]]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+class Packer:
+    """
+    turns ranked chunks into a context string: a token budget via `get_tokens`,
+    or the top n chunks whole when `budget` is None
+    """
+
+    def __init__(self, index: CorpusIndex, budget: Optional[int], n: int = 5, mode: str = "truncate"):
+        self.index = index
+        self.budget = budget
+        self.n = n
+        self.mode = mode
+        self.tokens = index.token_store(TOKENIZER_NAME) if budget is not None else None
+
+    def __call__(self, scores) -> str:
+        if self.budget is None:
+            return top_n(self.n, scores, self.index.chunks)
+        return get_tokens(self.budget, scores, self.index.chunks, self.tokens, self.mode)
+
+
+def retrieve(
+    index: CorpusIndex,
+    packer: Packer,
+    queries: List[str],
+    vectors: np.ndarray,
+    k: int,
+    fusion: Dict,
+    cache: Optional[QueryCache] = None,
+) -> List[Dict]:
+    """
+    with a `cache`, queries it already has (exactly or by similarity) reuse the
+    cached ranking and packed context and only the rest are ranked
+    """
+    start = time.perf_counter()
+    settings = {"k": k, "budget": packer.budget, "n": packer.n, "mode": packer.mode, **fusion}
+    ranked: List = [None] * len(queries)
+    contexts: List = [None] * len(queries)
+    todo = list(range(len(queries)))
+    if cache is not None:
+        todo = []
+        for i, (query, vector) in enumerate(zip(queries, vectors)):
+            hit = cache.get(query, index.version, settings) or cache.get_similar(vector, index.version, settings)
+            if hit is None:
+                todo.append(i)
+            else:
+                ranked[i], contexts[i] = hit.ranked, hit.context
+        # repeats within this batch aren't in the cache yet, rank them once
+        first: Dict[str, int] = {}
+        repeats = [(i, first.setdefault(normalise_query(queries[i]) or str(i), i)) for i in todo]
+        todo = sorted(set(first.values()))
+    if todo:
+        fresh = rank_hybrid_batch(index, [queries[i] for i in todo], vectors[todo], k, **fusion)
+        for i, scores in zip(todo, fresh):
+            ranked[i], contexts[i] = scores, packer(scores)
+            if cache is not None:
+                cache.put(queries[i], index.version, vectors[i], scores, settings, contexts[i])
+    if cache is not None:
+        for i, j in repeats:
+            ranked[i], contexts[i] = ranked[j], contexts[j]
+    share_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return [
+        {
+            "query": query,
+            "retrieved": [i for i, _ in scores],
+            "prompt": PROMPT.replace("<rag_token>", context).replace("<question_token>", query),
+            "retrieval_ms": share_ms,
+        }
+        for query, scores, context in zip(queries, ranked, contexts)
+    ]
+
+
+async def evaluate(
+    index: CorpusIndex,
+    queries: List[str],
+    generate: Callable[[str], ModelReport],
+    packer: Packer,
+    k: int = 10,
+    concurrency: int = 4,
+    retrieve_batch: int = 64,
+    fusion: Optional[Dict] = None,
+    on_result: Optional[Callable[[Dict, ModelReport], None]] = None,
+    cache: Optional[QueryCache] = None,
+) -> List[Dict]:
+    """
+    runs every query through retrieval and generation and returns the records
+    in query order
+    """
+    from embedder import embed
+
+    loop = asyncio.get_running_loop()
+    retrieval_pool = ThreadPoolExecutor(max_workers=1)
+    generation_pool = ThreadPoolExecutor(max_workers=concurrency)
+    # a couple of prompts per worker ready to go, no more
+    ready: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)
+    records: List[Optional[Dict]] = [None] * len(queries)
+
+    async def produce() -> None:
+        try:
+            with span("embed_queries", queries=len(queries)):
+                vectors = await loop.run_in_executor(
+                    retrieval_pool, lambda: np.atleast_2d(np.asarray(embed(queries), dtype=np.float32))
+                )
+            for start in range(0, len(queries), retrieve_batch):
+                batch = queries[start:start + retrieve_batch]
+                items = await loop.run_in_executor(
+                    retrieval_pool, retrieve, index, packer, batch, vectors[start:start + retrieve_batch], k, fusion or {}, cache,
+                )
+                for offset, item in enumerate(items):
+                    item["query_id"] = start + offset
+                    item["queued"] = time.perf_counter()
+                    await ready.put(item)
+        finally:
+            for _ in range(concurrency):
+                await ready.put(None)
+
+    async def consume() -> None:
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            prompt = item.pop("prompt")
+            started = time.perf_counter()
+            try:
+                report = await loop.run_in_executor(generation_pool, generate, prompt)
+            except Exception as e:
+                # one failed request shouldn't take the rest of the run down with it
+                report = ModelReport()
+                report.prompt = prompt
+                report.error = f"{type(e).__name__}: {e}"
+            done = time.perf_counter()
+            record = {
+                "query_id": item["query_id"],
+                "query": item["query"],
+                "retrieved": item["retrieved"],
+                "retrieval_ms": item["retrieval_ms"],
+                "queue_ms": (started - item.pop("queued")) * 1000,
+                "generation_ms": (done - started) * 1000,
+            }
+            records[record["query_id"]] = record
+            if on_result is not None:
+                on_result(record, report)
+
+    try:
+        await asyncio.gather(produce(), *[consume() for _ in range(concurrency)])
+    finally:
+        retrieval_pool.shutdown(wait=False)
+        generation_pool.shutdown(wait=False)
+    return records
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="one query per line, or a query set json")
+    parser.add_argument("--index", type=str, default="test_doc.md", help="source document to retrieve from")
+    parser.add_argument("--index-dir", type=str)
+    parser.add_argument("--k", type=int, default=10, help="chunks ranked per query")
+    parser.add_argument("--budget", type=int, help="context token budget (default: --top-n whole chunks)")
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--packing", choices=["truncate", "knapsack"], default="truncate")
+    parser.add_argument("--fusion", choices=["linear", "rrf"], default="linear")
+    parser.add_argument("--retrieve-batch", type=int, default=64, help="queries ranked per vectorised pass")
+    parser.add_argument("--concurrency", type=int, default=4, help="generation requests in flight")
+    parser.add_argument("--query-cache", action="store_true", help="reuse retrieval for repeated/near-duplicate queries")
+    parser.add_argument("--cache-threshold", type=float, default=DEFAULT_THRESHOLD, help="semantic match similarity")
+    parser.add_argument("--backend", choices=["pixi", "server"], default="server")
+    parser.add_argument("--server-url", type=str, default=DEFAULT_SERVER_URL)
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--top-p", type=float)
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-cache", action="store_true", help="always generate, ignoring the result cache")
+    parser.add_argument("--out", type=str, default="rag_eval.jsonl")
+    parser.add_argument("--store", type=str, help="also append every report to this results store")
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    if not queries:
+        print(f"no queries in {args.queries}")
+        return 0
+    index = load_or_build(args.index, args.index_dir)
+    packer = Packer(index, args.budget, args.top_n, args.packing)
+    params = {"temperature": args.temperature, "top_p": args.top_p, "top_k": args.top_k, "seed": args.seed}
+
+    client: Optional[ServerClient] = None
+    if args.backend == "server":
+        client = ServerClient(args.server_url, pool_size=args.concurrency)
+        generate = lambda prompt: run_server_generate(prompt, client=client, use_cache=not args.no_cache, **params)
+        concurrency = args.concurrency
+    else:
+        generate = lambda prompt: run_pixi_generate(prompt, use_cache=not args.no_cache, **params)
+        concurrency = 1
+
+    store = ResultsStore(args.store) if args.store else None
+    cache = QueryCache(args.cache_threshold, max(len(queries), 1)) if args.query_cache else None
+    out = open(args.out, "a")
+    failed = 0
+
+    def on_result(record: Dict, report: ModelReport) -> None:
+        nonlocal failed
+        failed += report.error is not None
+        out.write(json.dumps({**report.as_dict(), **record}) + "\n")
+        if store is not None:
+            store.append(report, backend=args.backend, sweep="rag_eval", **record)
+        status = f"error: {report.error}" if report.error is not None else f"{record['generation_ms']:.0f}ms"
+        print(f"[{record['query_id'] + 1}/{len(queries)}] {status}\t{record['query'][:80]}")
+
+    start = time.perf_counter()
+    try:
+        records = asyncio.run(evaluate(
+            index, queries, generate, packer, args.k, concurrency, args.retrieve_batch, {"method": args.fusion}, on_result, cache,
+        ))
+    finally:
+        out.close()
+        if client is not None:
+            client.close()
+    wall_s = time.perf_counter() - start
+
+    generation_s = sum(r["generation_ms"] for r in records) / 1000
+    print(
+        f"{len(records)} queries in {wall_s:.1f}s ({len(records) / wall_s:.1f}/s), "
+        f"retrieval {np.mean([r['retrieval_ms'] for r in records]):.1f}ms/query, "
+        f"generation busy {generation_s / (wall_s * concurrency):.0%} of {concurrency} slots, {failed} failed"
+    )
+    if cache is not None:
+        print("query cache: " + " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in cache.stats().items()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
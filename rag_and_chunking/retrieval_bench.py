@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+from corpus_index import file_hash, make_chunks
+from fusion import fuse_top_k
+from hybrid import BM25Index, tokenize_str
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+"""
+retrieval quality and speed, measured instead of eyeballed.  a query set is a
+json file naming a source document and, per query, one or more answer passages
+copied verbatim from it:
+
+    {"source": "test_doc.md",
+     "queries": [{"query": "how do I make a blockquote?",
+                  "answers": ["wrap the text and put a `>` before every line:"]}]}
+
+answers are located in the source once and become character spans, so the same
+labels work for every chunker: a chunk is relevant when its start/end offsets
+overlap an answer span (or, for chunks without offsets, when its text contains
+the answer).  for every chunker x fusion combination this reports
+
+    recall@k    share of answer passages touched by the top k chunks
+    mrr         1 / rank of the first relevant chunk (within the top max k)
+    ndcg@k      binary relevance, ideal ordering = every relevant chunk first
+
+and per stage (chunking, embedding, dense, bm25, tokenize, fusion, packing) the
+wall time, peak python/numpy allocation (tracemalloc) and the process's peak RSS
+so far.  tracemalloc slows python-heavy stages down; `--no-memory` turns it off
+when only the times matter.  the embedding cache is bypassed unless `--cache`.
+
+    python retrieval_bench.py bench_queries.json --chunker semantic:0.75 \\
+        --chunker fixed:512:64 --chunker structure --fusion linear:0.5:max --fusion rrf
+
+every result is appended to `--out` (bench_results.jsonl) with the git revision,
+host and a hash of the query set, and printed next to its change from the last
+run of the same configuration on the same query set
+"""
+
+DEFAULT_KS = (1, 3, 5, 10)
+TOKENIZER_NAME = "google/gemma-3-4b-it"
+
+
+def parse_chunker(spec: str) -> Dict:
+    """
+    "semantic:0.75", "structure" or "fixed:512:64"
+    """
+    name, *args = spec.split(":")
+    if name == "semantic":
+        return {"name": name, "threshold": float(args[0]) if args else 0.75}
+    if name == "structure":
+        return {"name": name}
+    if name == "fixed":
+        return {"name": name, "size": int(args[0]), "overlap": int(args[1]) if len(args) > 1 else 0}
+    raise ValueError(f"unknown chunker spec: {spec}")
+
+
+def parse_fusion(spec: str) -> Dict:
+    """
+    "linear:0.5:max" (alpha, normalisation) or "rrf" / "rrf:60"
+    """
+    method, *args = spec.split(":")
+    if method == "linear":
+        return {"method": method, "alpha": float(args[0]) if args else 0.5, "norm": args[1] if len(args) > 1 else "max"}
+    if method == "rrf":
+        return {"method": method, "rrf_k": int(args[0]) if args else 60}
+    raise ValueError(f"unknown fusion spec: {spec}")
+
+
+def label(settings: Dict) -> str:
+    return ":".join(str(v) for v in settings.values())
+
+
+def answer_spans(text: str, answers: Sequence[str]) -> List[Tuple[int, int]]:
+    spans = []
+    for answer in answers:
+        start = text.find(answer)
+        if start < 0:
+            raise ValueError(f"answer not found in the source: {answer[:60]!r}")
+        spans.append((start, start + len(answer)))
+    return spans
+
+
+def relevant_chunks(chunks, spans: Sequence[Tuple[int, int]], text: str) -> List[Set[int]]:
+    """
+    for each answer span, the ids of the chunks that cover any of it
+    """
+    hits: List[Set[int]] = [set() for _ in spans]
+    for i, c in enumerate(chunks):
+        meta = c.meta
+        for j, (a, b) in enumerate(spans):
+            if "start" in meta:
+                if meta["start"] < b and a < meta["end"]:
+                    hits[j].add(i)
+            elif text[a:b] in c.txt:
+                hits[j].add(i)
+    return hits
+
+
+def recall_at_k(ranked: Sequence[int], per_answer: List[Set[int]], k: int) -> float:
+    top = set(ranked[:k])
+    return sum(1 for ids in per_answer if ids & top) / len(per_answer)
+
+
+def reciprocal_rank(ranked: Sequence[int], relevant: Set[int]) -> float:
+    for rank, i in enumerate(ranked, 1):
+        if i in relevant:
+            return 1 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked: Sequence[int], relevant: Set[int], k: int) -> float:
+    dcg = sum(1 / math.log2(rank + 1) for rank, i in enumerate(ranked[:k], 1) if i in relevant)
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(k, len(relevant)) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+class StageTimer:
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        if self.memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            result = {"ms": (time.perf_counter() - start) * 1000}
+            if self.memory:
+                result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+            # ru_maxrss is in KiB on linux
+            result["rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            self.stages[name] = result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_chunker(
+    text: str,
+    queries: List[Dict],
+    chunker: Dict,
+    fusions: List[Dict],
+    ks: Sequence[int],
+    tokenizer=None,
+    budget: int = 1024,
+    memory: bool = True,
+) -> List[Dict]:
+    """
+    chunking, embedding and BM25 happen once per chunker, fusion and packing
+    once per fusion setting.  returns one result per fusion setting
+    """
+    from embedder import embed
+
+    timer = StageTimer(memory)
+    query_texts = [q["query"] for q in queries]
+
+    with timer.stage("chunking"):
+        chunks = make_chunks(text, chunker)
+    texts = [c.txt for c in chunks]
+    with timer.stage("embedding"):
+        chunk_vectors = np.atleast_2d(np.asarray(embed(texts), dtype=np.float32))
+        query_vectors = np.atleast_2d(np.asarray(embed(query_texts), dtype=np.float32))
+    with timer.stage("dense"):
+        dense = query_vectors @ chunk_vectors.T
+    with timer.stage("bm25"):
+        sparse = BM25Index(chunks).score_batch([tokenize_str(q) for q in query_texts])
+    counts = None
+    if tokenizer is not None:
+        from token_store import TokenStore
+        with timer.stage("tokenize"):
+            counts = TokenStore.build(texts, tokenizer, getattr(tokenizer, "name_or_path", TOKENIZER_NAME)).counts
+
+    per_answer = [relevant_chunks(chunks, answer_spans(text, q["answers"]), text) for q in queries]
+    relevant = [set().union(*hits) for hits in per_answer]
+    max_k = max(ks)
+
+    results = []
+    for fusion in fusions:
+        stages = dict(timer.stages)
+        fusion_timer = StageTimer(memory)
+        with fusion_timer.stage("fusion"):
+            _, ids = fuse_top_k(dense, sparse, max_k, **fusion)
+        if counts is not None:
+            from token_store import pack_prefix
+            with fusion_timer.stage("packing"):
+                for row in ids:
+                    pack_prefix(row, counts, budget)
+        stages.update(fusion_timer.stages)
+
+        ranked = ids.tolist()
+        metrics = {f"recall@{k}": float(np.mean([recall_at_k(r, a, k) for r, a in zip(ranked, per_answer)])) for k in ks}
+        metrics["mrr"] = float(np.mean([reciprocal_rank(r, rel) for r, rel in zip(ranked, relevant)]))
+        metrics[f"ndcg@{max_k}"] = float(np.mean([ndcg_at_k(r, rel, max_k) for r, rel in zip(ranked, relevant)]))
+        results.append({
+            "chunker": chunker,
+            "fusion": fusion,
+            "n_chunks": len(chunks),
+            "metrics": metrics,
+            "stages": stages,
+        })
+    return results
+
+
+def previous_results(path: str, query_set_hash: str) -> Dict[Tuple[str, str], Dict]:
+    """
+    the most recent earlier result for each (chunker, fusion) on the same query set
+    """
+    latest: Dict[Tuple[str, str], Dict] = {}
+    if not os.path.exists(path):
+        return latest
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("query_set_hash") == query_set_hash:
+                latest[(label(record["chunker"]), label(record["fusion"]))] = record
+    return latest
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("queries", help="query set json")
+    parser.add_argument("--source", type=str, help="overrides the query set's source document")
+    parser.add_argument("--chunker", action="append", help="semantic:0.75, structure, fixed:512:64 (repeatable)")
+    parser.add_argument("--fusion", action="append", help="linear:0.5:max, linear:0.3:zscore, rrf:60 (repeatable)")
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS))
+    parser.add_argument("--tokenizer", type=str, default=TOKENIZER_NAME, help="for the packing stage")
+    parser.add_argument("--no-packing", action="store_true")
+    parser.add_argument("--budget", type=int, default=1024, help="packing token budget")
+    parser.add_argument("--cache", action="store_true", help="let embeddings come from the embedding cache")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, for cleaner timings")
+    parser.add_argument("--out", type=str, default="bench_results.jsonl")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["EMBEDDING_CACHE"] = "0"
+
+    with open(args.queries, "rb") as f:
+        raw = f.read()
+    query_set = json.loads(raw)
+    query_set_hash = hashlib.sha1(raw).hexdigest()[:12]
+    source = args.source or os.path.join(os.path.dirname(os.path.abspath(args.queries)), query_set["source"])
+    with open(source, "r") as f:
+        text = f.read().strip()
+
+    chunkers = [parse_chunker(s) for s in args.chunker or ["semantic:0.75"]]
+    fusions = [parse_fusion(s) for s in args.fusion or ["linear:0.5:max"]]
+    tokenizer = None
+    if not args.no_packing:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+
+    previous = previous_results(args.out, query_set_hash)
+    run = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "host": socket.gethostname(),
+        "query_set": os.path.abspath(args.queries),
+        "query_set_hash": query_set_hash,
+        "source_hash": file_hash(source),
+        "n_queries": len(query_set["queries"]),
+    }
+
+    metric_names = [f"recall@{k}" for k in args.k] + ["mrr", f"ndcg@{max(args.k)}"]
+    print(f"{'chunker':<18}{'fusion':<18}{'chunks':>7}" + "".join(f"{m:>17}" for m in metric_names))
+    records = []
+    for chunker in chunkers:
+        for result in run_chunker(text, query_set["queries"], chunker, fusions, args.k, tokenizer, args.budget, not args.no_memory):
+            record = {**run, **result}
+            records.append(record)
+            before = previous.get((label(result["chunker"]), label(result["fusion"])))
+            cells = []
+            for m in metric_names:
+                value = result["metrics"][m]
+                delta = f" ({value - before['metrics'][m]:+.3f})" if before and m in before["metrics"] else ""
+                cells.append(f"{value:.3f}{delta}".rjust(17))
+            print(f"{label(chunker):<18}{label(result['fusion']):<18}{result['n_chunks']:>7}" + "".join(cells))
+            print("    " + "  ".join(
+                f"{name} {s['ms']:.1f}ms" + (f"/{s['peak_mb']:.1f}MB" if "peak_mb" in s else "")
+                for name, s in result["stages"].items()
+            ))
+
+    with open(args.out, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from corpus_index import CorpusIndex, load_or_build
+from query_cache import DEFAULT_THRESHOLD, QueryCache
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+"""
+a long-running retrieval daemon.  every tester/tester2 run is a cold start that
+imports torch, loads the sentence model and opens the corpus index just to answer
+one query; this keeps all of that in memory and answers over HTTP, on a TCP port
+or a unix socket:
+
+    python retrieval_server.py test_doc.md --port 8100
+    curl -s localhost:8100/query -d '{"query": "what is bm25?", "k": 3}'
+
+"method", "alpha", "norm" and "rrf_k" in the body are passed on to `fusion.fuse`,
+and a "depth" switches to cascade scoring of that many BM25 candidates.
+
+concurrent queries are collected into micro-batches (up to `--max-batch` of them,
+waiting at most `--max-wait-ms` for more to arrive) and embedded with one forward
+pass.  while a batch is being embedded the next one keeps filling up, so under
+load the batches grow on their own.  each response carries the hybrid top k and
+where the time went:
+
+    queue_ms    waiting for the batch to start
+    embed_ms    the batch's forward pass (shared by everything in it)
+    score_ms    dense + BM25 scoring of this query
+    total_ms    request in to response out
+
+with `--cache-size` above 0, repeated queries (same words, or an embedding at
+least `--cache-threshold` similar) are answered from a `QueryCache`; "cached"
+in the response says "exact" or "semantic", and /health reports its hit rate
+
+`python retrieval_server.py query "what is bm25?" --concurrency 16` sends the same
+query from many connections at once to see the batching work
+"""
+
+DEFAULT_PORT = 8100
+FUSION_KEYS = ("method", "alpha", "norm", "rrf_k")
+
+
+class QueryBatcher:
+    """
+    turns single `embed` awaits into batched calls of `encode`, which gets a list of
+    strings and returns one row per string.  encoding runs on one worker thread so
+    the event loop keeps accepting requests meanwhile
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch: int = 32, max_wait_ms: float = 2.0):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue: Optional[asyncio.Queue] = None
+        self.batches = 0
+        self.queries = 0
+
+    async def embed(self, query: str) -> Tuple[np.ndarray, Dict]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, future, time.perf_counter()))
+        return await future
+
+    def _drain(self, batch: List) -> None:
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        while True:
+            batch = [await self.queue.get()]
+            self._drain(batch)
+            if len(batch) < self.max_batch and self.max_wait_s > 0:
+                await asyncio.sleep(self.max_wait_s)
+                self._drain(batch)
+
+            started = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.encode, [q for q, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            embed_ms = (time.perf_counter() - started) * 1000
+
+            self.batches += 1
+            self.queries += len(batch)
+            vectors = np.atleast_2d(vectors)
+            for (_, future, queued), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result((vector, {
+                        "queue_ms": (started - queued) * 1000,
+                        "embed_ms": embed_ms,
+                        "batch_size": len(batch),
+                    }))
+
+
+class RetrievalServer:
+    def __init__(self, index: CorpusIndex, batcher: QueryBatcher, default_k: int = 5, cache: Optional[QueryCache] = None):
+        self.index = index
+        self.batcher = batcher
+        self.default_k = default_k
+        self.cache = cache
+
+    async def query(self, query: str, k: int, fusion: Optional[Dict] = None, depth: Optional[int] = None) -> Dict:
+        from tester import rank_cascade, rank_hybrid
+
+        start = time.perf_counter()
+        settings = {"k": k, "depth": depth, **(fusion or {})}
+        cached = None
+        hit = self.cache.get(query, self.index.version, settings) if self.cache is not None else None
+        if hit is not None:
+            cached, timings = "exact", {}
+        else:
+            vector, timings = await self.batcher.embed(query)
+            if self.cache is not None:
+                hit = self.cache.get_similar(vector, self.index.version, settings)
+                cached = "semantic" if hit is not None else None
+        scored = time.perf_counter()
+        if hit is not None:
+            ranked = hit.ranked
+        else:
+            if depth is not None:
+                rank = lambda: rank_cascade(self.index, query, vector, k, depth, **(fusion or {}))
+            else:
+                rank = lambda: rank_hybrid(self.index, query, vector, k, **(fusion or {}))
+            ranked = await asyncio.get_running_loop().run_in_executor(None, rank)
+            if self.cache is not None:
+                self.cache.put(query, self.index.version, vector, ranked, settings)
+        done = time.perf_counter()
+        timings["score_ms"] = (done - scored) * 1000
+        timings["total_ms"] = (done - start) * 1000
+
+        chunks = self.index.chunks
+        return {
+            "results": [{"id": i, "score": s, "txt": chunks[i].txt, "meta": chunks[i].meta} for i, s in ranked],
+            "cached": cached,
+            "timings": timings,
+        }
+
+    async def respond(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if method == "GET" and path == "/health":
+            return 200, {
+                "chunks": len(self.index),
+                "source": self.index.manifest.get("source"),
+                "batches": self.batcher.batches,
+                "queries": self.batcher.queries,
+                "cache": self.cache.stats() if self.cache is not None else None,
+            }
+        if method == "POST" and path == "/query":
+            try:
+                request = json.loads(body)
+                query = request["query"]
+                k = int(request.get("k", self.default_k))
+                fusion = {key: request[key] for key in FUSION_KEYS if key in request}
+                depth = int(request["depth"]) if "depth" in request else None
+            except (ValueError, KeyError, TypeError):
+                return 400, {"error": 'expected a json body like {"query": "...", "k": 5}'}
+            try:
+                return 200, await self.query(query, k, fusion, depth)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        just enough HTTP/1.1 for json in, json out, with keep-alive
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    status, payload = await self.respond(method, path, body)
+                except Exception as e:
+                    status, payload = 500, {"error": repr(e)}
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                writer.write(
+                    f"HTTP/1.1 {status} {http.client.responses[status]}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(server: RetrievalServer, host: str, port: int, unix: Optional[str] = None) -> None:
+    batching = asyncio.ensure_future(server.batcher.run())
+    if unix:
+        if os.path.exists(unix):
+            os.remove(unix)
+        listener = await asyncio.start_unix_server(server.handle, path=unix)
+        where = unix
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        for sock in listener.sockets:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        where = f"http://{host}:{port}"
+    print(f"serving {len(server.index)} chunks on {where}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        batching.cancel()
+
+
+def query_once(query: str, k: int, host: str = "localhost", port: int = DEFAULT_PORT) -> Dict:
+    conn = http.client.HTTPConnection(host, port)
+    try:
+        conn.request("POST", "/query", json.dumps({"query": query, "k": k}), {"Content-Type": "application/json"})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def run_client(args: argparse.Namespace) -> int:
+    if args.concurrency <= 1:
+        response = query_once(args.query, args.k, args.host, args.port)
+        for r in response["results"]:
+            print(f"{r['id']}\t{r['score']:.4f}\t{r['txt'][:120]}")
+        print(json.dumps({k: round(v, 2) for k, v in response["timings"].items()}))
+        return 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        responses = list(pool.map(lambda _: query_once(args.query, args.k, args.host, args.port), range(args.concurrency)))
+    wall_ms = (time.perf_counter() - start) * 1000
+    totals = sorted(r["timings"]["total_ms"] for r in responses)
+    batches = sorted(r["timings"].get("batch_size", 0) for r in responses)
+    print(f"{args.concurrency} queries in {wall_ms:.1f}ms, server total_ms p50 {totals[len(totals) // 2]:.1f} "
+          f"max {totals[-1]:.1f}, batch sizes {batches[0]}-{batches[-1]}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="source document to serve, or 'query' to act as a client")
+    parser.add_argument("query", nargs="?", help="query text, client mode only")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", type=str, help="listen on this unix socket instead of a TCP port")
+    parser.add_argument("--index-dir", type=str)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=1, help="client mode: parallel requests")
+    parser.add_argument("--cache-size", type=int, default=0, help="cached query results, 0 for no cache")
+    parser.add_argument("--cache-threshold", type=float, default=DEFAULT_THRESHOLD, help="semantic match similarity")
+    parser.add_argument("--cache-ttl", type=float, help="seconds a cached result stays valid")
+    args = parser.parse_args()
+
+    if args.path == "query":
+        if not args.query:
+            raise SystemExit("usage: retrieval_server.py query <text> [--concurrency N]")
+        return run_client(args)
+
+    # pay every start-up cost before the first request instead of during it
+    import embedder
+    index = load_or_build(args.path, args.index_dir)
+    model = embedder._get_model()
+    # straight to the model: the persistent embedding cache would take a file
+    # lock and grow on disk with every distinct query, for text seen about once
+    encode = lambda queries: model.encode(queries, normalize_embeddings=True)
+
+    cache = QueryCache(args.cache_threshold, args.cache_size, args.cache_ttl) if args.cache_size > 0 else None
+    server = RetrievalServer(index, QueryBatcher(encode, args.max_batch, args.max_wait_ms), args.k, cache)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
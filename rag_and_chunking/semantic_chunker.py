@@ -2,60 +2,116 @@
 
 from embedder import embed
 from chunker import Chunk
-from typing import List
+from typing import List, Tuple
+import itertools
 import numpy as np
 import re
 
 
 # thanks gpt
 def sentence_split(text: str) -> List[str]:
-    sentences: List[str] = []
-    text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
-    text = text.replace("\n", " ")
-    sentences = re.split(r"(?<=[.!?])\s+| {4}", text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    return sentences
+    return [s for s, _, _ in sentence_spans(text)]
+
+
+def sentence_spans(text: str) -> List[Tuple[str, int, int]]:
+    """
+    same split as before (drop code blocks, newlines become spaces, split after
+    sentence punctuation or on 4 spaces) but each sentence also carries its
+    start/end character offsets in the original `text`
+    """
+    # positions in the cleaned text -> positions in `text`.  removing code blocks
+    # is the only step that changes length, newline -> space doesn't
+    kept: List[int] = []
+    cleaned_parts: List[str] = []
+    pos = 0
+    for m in re.finditer(r"```.*?```", text, flags=re.DOTALL):
+        cleaned_parts.append(text[pos:m.start()])
+        kept.extend(range(pos, m.start()))
+        pos = m.end()
+    cleaned_parts.append(text[pos:])
+    kept.extend(range(pos, len(text)))
+    cleaned = "".join(cleaned_parts).replace("\n", " ")
+
+    spans: List[Tuple[str, int, int]] = []
+    piece_start = 0
+    for m in itertools.chain(re.finditer(r"(?<=[.!?])\s+| {4}", cleaned), [None]):
+        piece_end = m.start() if m is not None else len(cleaned)
+        piece = cleaned[piece_start:piece_end]
+        sentence = piece.strip()
+        if sentence:
+            lead = len(piece) - len(piece.lstrip())
+            first = piece_start + lead
+            last = first + len(sentence) - 1
+            spans.append((sentence, kept[first], kept[last] + 1))
+        if m is not None:
+            piece_start = m.end()
+    return spans
+
+
+def embed_sentences(sentences: List[str], batch_size: int = 4096) -> np.ndarray:
+    """
+    one (n, d) matrix for all sentences.  goes through `embed` a block at a time,
+    so a huge document is still only a handful of batched encodes, without
+    holding every intermediate batch at once
+    """
+    blocks = [
+        np.atleast_2d(embed(sentences[i:i + batch_size]))
+        for i in range(0, len(sentences), batch_size)
+    ]
+    return np.vstack(blocks)
 
 
 def semantic_chunks(raw_text: str, threshold=0.75) -> List[Chunk]:
     chunks: List[Chunk] = []
 
-    # Split text into sentences
-    sentences = sentence_split(raw_text)
-    # Embed each sentence
-    embedded_sentences = [embed(s) for s in sentences]
-    
+    # Split text into sentences, keeping where each one came from
+    spans = sentence_spans(raw_text)
+    if not spans:
+        return chunks
+    sentences = [s for s, _, _ in spans]
+    # Embed every sentence in one go, row i is sentence i
+    embedded_sentences = embed_sentences(sentences)
+
+    # similarity of each sentence to the one before it.  when the current chunk is
+    # a single sentence its centroid *is* that sentence, so these cover the first
+    # comparison of every chunk without touching the running centroid
+    neighbour_sims = np.einsum("ij,ij->i", embedded_sentences[1:], embedded_sentences[:-1])
+
     # Accumulate sentences into a chunk while
     # cosine(avg_chunk_embedding, next_sentence_embedding) > threshold
     # Cut when similarity drops
     current_sentences = [sentences[0]]
-    current_vector = embedded_sentences[0]
+    current_vector = embedded_sentences[0].copy()
+    current_start = spans[0][1]
 
     # iterate over our sentences.  evaluate the similarity of each new sentence to the accumulated chunk so far
     # if the similarity meets the threshold, add it to the current chunk's vector and mean
     # else, start a new chunk
-    # note: start with `sentences[1:], embedded_sentences[1:]` because we already start with the 0th values
-    for sentence, vector in zip(sentences, embedded_sentences):
-        similarity = current_vector @ vector
+    # note: start at 1 because we already start with the 0th values
+    for i in range(1, len(sentences)):
+        vector = embedded_sentences[i]
+        if len(current_sentences) == 1:
+            similarity = neighbour_sims[i - 1]
+        else:
+            similarity = current_vector @ vector
         if similarity > threshold:
-            current_sentences.append(sentence)
+            current_sentences.append(sentences[i])
 
-            # adapt the current vector to include the 'meaning' of the newest embedded sentence
-            current_vector = np.mean(
-                [current_vector, vector],
-                axis=0
-            )
+            # adapt the current vector to include the 'meaning' of the newest embedded sentence.
+            # the mean of two vectors is their sum scaled by 1/2, and we renormalise anyway
+            current_vector += vector
             # normalize the result to maintain magnitude = 1
-            current_vector /= np.linalg.norm(current_vector)
+            current_vector /= np.sqrt(current_vector @ current_vector)
         else:
             chunks.append(
-                Chunk(txt='. '.join(current_sentences), meta={})
+                Chunk(txt='. '.join(current_sentences), meta={"start": current_start, "end": spans[i - 1][2]})
             )
-            current_sentences = [sentence]
-            current_vector = vector
+            current_sentences = [sentences[i]]
+            current_vector = vector.copy()
+            current_start = spans[i][1]
 
     chunks.append(
-        Chunk(txt='. '.join(current_sentences), meta={})
+        Chunk(txt='. '.join(current_sentences), meta={"start": current_start, "end": spans[-1][2]})
     )
 
     return chunks
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pytest
+
+from dense_index import top_k
+
+"""
+edge cases of `top_k`: run with `python -m pytest test_dense_index.py`
+"""
+
+
+def stable_top(scores: np.ndarray, k: int):
+    ids = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(scores, ids, axis=1), ids
+
+
+def test_k_zero_gives_empty_rows():
+    scores, ids = top_k(np.random.default_rng(0).random((2, 10)), 0)
+    assert scores.shape == (2, 0) and ids.shape == (2, 0)
+
+
+def test_k_past_the_end_is_clamped():
+    scores = np.random.default_rng(0).random((2, 10))
+    got_scores, got_ids = top_k(scores, 50)
+    want_scores, want_ids = stable_top(scores, 10)
+    assert np.array_equal(got_ids, want_ids) and np.array_equal(got_scores, want_scores)
+
+
+def test_all_ties_go_to_the_lowest_ids():
+    scores, ids = top_k(np.zeros((1, 1000)), 5)
+    assert ids.tolist() == [[0, 1, 2, 3, 4]] and scores.tolist() == [[0.0] * 5]
+
+
+def test_ties_straddling_the_cut_match_a_stable_sort():
+    scores = np.array([[1.0, 3.0, 2.0, 2.0, 2.0, 0.0], [2.0, 2.0, 2.0, 2.0, 5.0, 2.0]])
+    got_scores, got_ids = top_k(scores, 3)
+    want_scores, want_ids = stable_top(scores, 3)
+    assert np.array_equal(got_ids, want_ids) and np.array_equal(got_scores, want_scores)
+
+
+def test_non_integer_k_is_rejected():
+    with pytest.raises(ValueError, match="k must be an integer"):
+        top_k(np.zeros((1, 3)), 2.5)
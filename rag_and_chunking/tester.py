@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
 
-from embedder import best_match
+from embedder import best_match, embed
 from chunker import Chunk
+from corpus_index import CorpusIndex, load_or_build
+from dense_index import top_k
+from fusion import fuse, fuse_top_k
 from semantic_chunker import semantic_chunks
 from hybrid import tokenize_chunk, inverse_document_frequency, tokenize_str
-from typing import List, Tuple
+from query_cache import QueryCache
+from tracing import span
+from typing import List, Optional, Tuple
+import numpy as np
 import sys
 
+# BM25 candidates handed to dense scoring + fusion in cascade mode
+DEFAULT_DEPTH = 100
+
 
 def load_test_data(path: str = "test_doc.md") -> str:
     with open(path, "r") as f:
@@ -14,17 +23,24 @@ def load_test_data(path: str = "test_doc.md") -> str:
 
 
 def build_chunks(test_data: str) -> List[Chunk]:
-    # chunks = structure_aware(test_data)
-    # chunks = fixed_chunks(test_data, 128, 16)
-    return semantic_chunks(test_data)
-
-
-def compute_dense_scores(query: str, chunks: List[Chunk]) -> List[Tuple[int, float]]:
-    return sorted(
-        best_match(query, chunks),
-        key=lambda x: x[1],
-        reverse=True
-    )
+    with span("build_chunks") as s:
+        # chunks = structure_aware(test_data)
+        # chunks = fixed_chunks(test_data, 128, 16)
+        chunks = semantic_chunks(test_data)
+        s.count(chunks=len(chunks))
+    return chunks
+
+
+def compute_dense_scores(query: str, chunks: List[Chunk], k: Optional[int] = None) -> List[Tuple[int, float]]:
+    """
+    every chunk scored against the query, best first.  pass `k` to only get the
+    top k, which skips sorting the rest
+    """
+    matches = best_match(query, chunks)
+    if k is None:
+        return sorted(matches, key=lambda x: x[1], reverse=True)
+    scores, ids = top_k(np.array([[s for _, s in matches]]), k)
+    return list(zip(ids[0].tolist(), scores[0].tolist()))
 
 # print(f"Query:\n\t{query}")
 # 
@@ -34,6 +50,11 @@ def compute_dense_scores(query: str, chunks: List[Chunk]) -> List[Tuple[int, flo
 
 
 def bm25_score(tokenized_query: List[str], chunk: Chunk, chunks: List[Chunk], avgdl: float) -> float:
+    """
+    the textbook version, one chunk at a time.  kept for reference - it
+    re-tokenizes and recomputes IDF on every call, so `get_hybrid` uses
+    `hybrid.BM25Index` which does the same maths from precomputed stats
+    """
     tokenized_chunk = tokenize_chunk(chunk)
 
     # these params control how quickly TF stops mattering, and how aggressively
@@ -60,45 +81,121 @@ def normalise(scores: List[float]) -> List[float]:
     return [s / m if m > 0 else 0.0 for s in scores]
 
 
-def get_hybrid(query: str, path: str = "test_doc.md") -> List[Tuple[int, float]]:
-    test_data = load_test_data(path)
-    chunks = build_chunks(test_data)
-
-    dense_scores = compute_dense_scores(query, chunks)
-
-    query_tokens = tokenize_str(query)
-    dl = lambda x: len(tokenize_chunk(x))
-    avgdl = sum(dl(c) for c in chunks) / len(chunks)
-
-    bm25_scores = []
-    for i, c in enumerate(chunks):
-        s = bm25_score(query_tokens, c, chunks, avgdl)
-        bm25_scores.append((i, s))
-
-    bm25_scores.sort(key=lambda x: x[1], reverse=True)
-
-    dense_scores_by_chunk = [0.0] * len(chunks)
-    for i, s in dense_scores:
-        dense_scores_by_chunk[i] = s
-
-    sparse_scores_by_chunk = [0.0] * len(chunks)
-    for i, s in bm25_scores:
-        sparse_scores_by_chunk[i] = s
-
-    dense_scores_by_chunk = normalise(dense_scores_by_chunk)
-    sparse_scores_by_chunk = normalise(sparse_scores_by_chunk)
-
-    alpha = 0.5
-    hybrid_scores = [
-        alpha * d + (1 - alpha) * b
-        for d, b in zip(dense_scores_by_chunk, sparse_scores_by_chunk)
-    ]
-
-    return sorted(
-        enumerate(hybrid_scores),
-        key=lambda x: x[1],
-        reverse=True
-    )
+def get_hybrid(
+    query: str,
+    path: str = "test_doc.md",
+    index: Optional[CorpusIndex] = None,
+    k: Optional[int] = None,
+    depth: Optional[int] = None,
+    cache: Optional[QueryCache] = None,
+    **fusion,
+) -> List[Tuple[int, float]]:
+    """
+    chunks, embeddings and BM25 stats come from the prebuilt index (built on the
+    spot if it's missing or stale), so only the query itself gets embedded here.
+    `fusion` picks the method, alpha and normalisation, see `fusion.fuse`.
+    with a `depth`, only that many BM25 candidates are scored, see `rank_cascade`.
+    with a `cache`, a repeated or near-identical query gets its earlier ranking
+    """
+    with span("get_hybrid", chunks=0) as s:
+        if index is None:
+            index = load_or_build(path)
+        s.count(chunks=len(index))
+        settings = {"k": k, "depth": depth, **fusion}
+        if cache is not None:
+            hit = cache.get(query, index.version, settings)
+            if hit is not None:
+                s.count(cache_hits=1)
+                return hit.ranked
+        query_vector = embed(query)
+        if cache is not None:
+            hit = cache.get_similar(query_vector, index.version, settings)
+            if hit is not None:
+                s.count(cache_hits=1)
+                return hit.ranked
+        if depth is not None:
+            ranked = rank_cascade(index, query, query_vector, k, depth, **fusion)
+        else:
+            ranked = rank_hybrid(index, query, query_vector, k, **fusion)
+        if cache is not None:
+            cache.put(query, index.version, query_vector, ranked, settings)
+        return ranked
+
+
+def rank_hybrid(
+    index: CorpusIndex,
+    query: str,
+    query_vector: np.ndarray,
+    k: Optional[int] = None,
+    dense_kind: str = "exact",
+    **fusion,
+) -> List[Tuple[int, float]]:
+    """
+    the scoring half of `get_hybrid`, for callers that embed queries themselves
+    (the retrieval server embeds a whole batch of them at once).  every chunk,
+    best first, or only the top `k`.  `dense_kind` "float16"/"int8" scores
+    against quantized embeddings
+    """
+    with span("dense"):
+        dense = index.dense_scores(query_vector, dense_kind)
+    sparse = index.bm25.score(tokenize_str(query))
+    with span("fusion"):
+        if k is not None:
+            scores, ids = fuse_top_k(dense, sparse, k, **fusion)
+            return list(zip(ids[0].tolist(), scores[0].tolist()))
+        fused = fuse(dense, sparse, **fusion)
+        order = np.argsort(-fused, kind="stable")
+        return list(zip(order.tolist(), fused[order].tolist()))
+
+
+def rank_cascade(
+    index: CorpusIndex,
+    query: str,
+    query_vector: np.ndarray,
+    k: Optional[int] = None,
+    depth: int = DEFAULT_DEPTH,
+    dense_kind: str = "exact",
+    **fusion,
+) -> List[Tuple[int, float]]:
+    """
+    `rank_hybrid`, but BM25 first picks the `depth` best candidates from its
+    postings and only those get a dense score (from the stored embeddings) and
+    go through fusion, so a query costs about the same however big the corpus
+    is.  normalisation and RRF ranks are taken over the candidates, not the
+    whole corpus, so the order can differ a little from full scoring;
+    `cascade_bench.py` measures how much.  a query with no term in the corpus
+    has no candidates and falls back to full scoring.  `dense_kind` picks the
+    dense backend the candidates are scored against, as in `rank_hybrid`
+    """
+    with span("bm25_candidates", depth=depth) as s:
+        ids, sparse = index.bm25.top_candidates(tokenize_str(query), depth)
+        s.count(candidates=len(ids))
+    if not len(ids):
+        return rank_hybrid(index, query, query_vector, k, dense_kind, **fusion)
+    with span("dense", chunks=len(ids)):
+        dense = index.dense_scores(query_vector, dense_kind, ids)
+    with span("fusion"):
+        fused = fuse(dense, sparse, **fusion)
+        order = np.lexsort((ids, -fused))[:k]
+        return list(zip(ids[order].tolist(), fused[order].tolist()))
+
+
+def rank_hybrid_batch(
+    index: CorpusIndex,
+    queries: List[str],
+    query_vectors: np.ndarray,
+    k: int,
+    dense_kind: str = "exact",
+    **fusion,
+) -> List[List[Tuple[int, float]]]:
+    """
+    top `k` for many queries at once: one matrix product for the dense side and
+    one (n_queries, n_chunks) fusion
+    """
+    dense = index.dense_index(dense_kind).scores(query_vectors)
+    sparse = index.bm25.score_batch([tokenize_str(q) for q in queries])
+    scores, ids = fuse_top_k(dense, sparse, k, **fusion)
+    return [list(zip(i.tolist(), s.tolist())) for s, i in zip(scores, ids)]
 
 
 if __name__ == "__main__":
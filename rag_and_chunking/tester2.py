@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+import corpus_index
 import tester
 
 
@@ -12,9 +13,9 @@ def main() -> int:
     query = sys.argv[1]
     path = sys.argv[2] if len(sys.argv) > 2 else "test_doc.md"
 
-    scores = tester.get_hybrid(query, path)
-    test_data = tester.load_test_data(path)
-    chunks = tester.build_chunks(test_data)
+    index = corpus_index.load_or_build(path)
+    scores = tester.get_hybrid(query, path, index=index)
+    chunks = index.chunks
 
     print("top 3 hybrid scores")
     for idx, score in scores[:3]:
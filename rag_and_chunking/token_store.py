@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+from typing import List, Optional, Sequence, Tuple
+import json
+import os
+
+import numpy as np
+
+"""
+generator-tokenizer token counts for every chunk, worked out once.
+
+`get_tokens` used to run the gemma tokenizer over each ranked chunk on every
+query, then decode the ids it kept back into text.  a TokenStore holds the
+token ids of all chunks in one flat int32 array with an offsets array marking
+where each chunk starts (the same layout as the BM25 postings), plus the
+character offset where each token ends.  so:
+
+    tokens in chunk i       offsets[i + 1] - offsets[i]
+    first t tokens of i     txt[:char_ends[offsets[i] + t - 1]]
+
+and packing a context is arithmetic on `counts`, no tokenizer involved.  the
+arrays are saved into the corpus index directory by `CorpusIndex.token_store`
+"""
+
+KNAPSACK_SPAN = 4  # pack_knapsack looks at the best chunks worth this many budgets
+
+
+def safe_name(tokenizer_name: str) -> str:
+    return tokenizer_name.replace("/", "__")
+
+
+class TokenStore:
+    def __init__(self, tokenizer_name: str, ids: np.ndarray, offsets: np.ndarray, char_ends: np.ndarray):
+        self.tokenizer_name = tokenizer_name
+        self.ids = ids
+        self.offsets = offsets
+        self.char_ends = char_ends
+        self.counts = np.diff(offsets)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def chunk_ids(self, i: int) -> np.ndarray:
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def prefix(self, txt: str, i: int, n_tokens: int) -> str:
+        """
+        the text of the first `n_tokens` tokens of chunk i, sliced rather than decoded
+        """
+        if n_tokens <= 0:
+            return ""
+        if n_tokens >= self.counts[i]:
+            return txt
+        return txt[:int(self.char_ends[self.offsets[i] + n_tokens - 1])]
+
+    @classmethod
+    def build(cls, texts: Sequence[str], tokenizer, tokenizer_name: str, batch_size: int = 256) -> "TokenStore":
+        """
+        `tokenizer` is a HF fast tokenizer - it has to return offset mappings
+        """
+        ids: List[int] = []
+        char_ends: List[int] = []
+        offsets = [0]
+        for start in range(0, len(texts), batch_size):
+            batch = list(texts[start:start + batch_size])
+            encoded = tokenizer(batch, add_special_tokens=False, return_offsets_mapping=True)
+            for chunk_ids, mapping in zip(encoded["input_ids"], encoded["offset_mapping"]):
+                ids += chunk_ids
+                char_ends += [end for _, end in mapping]
+                offsets.append(len(ids))
+        return cls(
+            tokenizer_name,
+            np.array(ids, dtype=np.int32),
+            np.array(offsets, dtype=np.int64),
+            np.array(char_ends, dtype=np.int32),
+        )
+
+    def save(self, directory: str) -> None:
+        base = os.path.join(directory, f"tokens_{safe_name(self.tokenizer_name)}")
+        np.save(base + "_ids.npy", self.ids)
+        np.save(base + "_offsets.npy", self.offsets)
+        np.save(base + "_char_ends.npy", self.char_ends)
+        with open(base + ".json", "w") as f:
+            json.dump({"tokenizer": self.tokenizer_name, "n_chunks": len(self), "n_tokens": int(self.offsets[-1])}, f)
+
+    @classmethod
+    def load(cls, directory: str, tokenizer_name: str) -> Optional["TokenStore"]:
+        base = os.path.join(directory, f"tokens_{safe_name(tokenizer_name)}")
+        if not os.path.exists(base + ".json"):
+            return None
+        return cls(
+            tokenizer_name,
+            np.load(base + "_ids.npy", mmap_mode="r"),
+            np.load(base + "_offsets.npy"),
+            np.load(base + "_char_ends.npy", mmap_mode="r"),
+        )
+
+
+def pack_prefix(order: np.ndarray, counts: np.ndarray, budget: int) -> Tuple[np.ndarray, int]:
+    """
+    walk the ranked list until the budget runs out: a running total of token
+    counts and one binary search for the cut.  returns the chunks that fit whole,
+    and how many tokens of the next chunk still fit (0 if none, or none left)
+    """
+    if len(order) == 0 or budget <= 0:
+        return order[:0], 0
+    cumulative = np.cumsum(counts[order])
+    cut = int(np.searchsorted(cumulative, budget, side="right"))
+    used = int(cumulative[cut - 1]) if cut else 0
+    partial = budget - used if cut < len(order) else 0
+    return order[:cut], partial
+
+
+def pack_knapsack(
+    order: np.ndarray, counts: np.ndarray, scores: np.ndarray, budget: int, span: int = KNAPSACK_SPAN
+) -> np.ndarray:
+    """
+    the set of whole chunks with the highest total score that fits the budget
+    (0/1 knapsack over token counts), returned in rank order.  chunks are never
+    cut, so one big chunk can't crowd out several smaller, better ones.  scores
+    that aren't all positive (zscore or unnormalised fusion, negative cosine)
+    are shifted up first, so every chunk stays a candidate.  only the best
+    scored ones until their tokens add up to `span` budgets are considered -
+    the table is chunks x (budget + 1), and low scorers past that hardly ever
+    get picked
+    """
+    weights, values = counts[order].astype(np.int64), np.asarray(scores, dtype=np.float64)
+    if len(values) and values.min() <= 0:
+        values = values - values.min() + 1e-6 * (np.ptp(values) or 1.0)
+    fits = weights <= budget
+    order, weights, values = order[fits], weights[fits], values[fits]
+    if len(order) == 0 or budget <= 0:
+        return order
+
+    by_score = np.argsort(-values, kind="stable")
+    cut = int(np.searchsorted(np.cumsum(weights[by_score]), span * budget)) + 1
+    top = np.sort(by_score[:cut])
+    order, weights, values = order[top], weights[top], values[top]
+
+    # best[c] = best total score using at most c tokens; one vectorised pass per chunk
+    best = np.zeros(budget + 1)
+    took = np.zeros((len(order), budget + 1), dtype=bool)
+    for j, (w, v) in enumerate(zip(weights.tolist(), values.tolist())):
+        candidate = best[:budget + 1 - w] + v
+        better = candidate > best[w:]
+        took[j, w:] = better
+        best[w:] = np.where(better, candidate, best[w:])
+
+    chosen = []
+    c = budget
+    for j in range(len(order) - 1, -1, -1):
+        if took[j, c]:
+            chosen.append(j)
+            c -= weights[j]
+    return order[sorted(chosen)]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+"""
+spans around the stages of the RAG + generation path, off unless asked for:
+
+    RAG_TRACE=trace.json python tester2.py "what is markdown?"
+
+writes `trace.json` in chrome trace format (open it in https://ui.perfetto.dev
+or chrome://tracing) and prints a per-stage summary when the process exits.
+`tracing.enable(path)` does the same from code.
+
+    with span("embed", texts=len(texts)) as s:
+        ...
+        s.count(cache_hits=hits)
+
+records one complete event with the counts as its args.  while tracing is off
+`span` hands back one shared do-nothing object and `traced` calls straight
+through, so instrumented code pays one global lookup per call.
+
+sampling profiler: RAG_PROFILE=embed,bm25_score (or `enable(path, profile=...)`)
+starts a thread that every `RAG_PROFILE_INTERVAL_MS` (default 1) grabs the stack
+of any thread currently inside one of those spans.  the stacks are written to
+`<trace>.folded`, one "span;frame;frame count" line per distinct stack, which
+flamegraph.pl and speedscope read directly
+"""
+
+_ENABLED = False
+_PATH: Optional[str] = None
+_EVENTS: List[Dict] = []
+_LOCK = threading.Lock()
+_ORIGIN = time.perf_counter()
+_PROFILER: Optional["SamplingProfiler"] = None
+
+
+class _NoSpan:
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def count(self, **counts) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        if _PROFILER is not None:
+            _PROFILER.push(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = time.perf_counter()
+        if _PROFILER is not None:
+            _PROFILER.pop()
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start - _ORIGIN) * 1e6,
+            "dur": (end - self.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args,
+        }
+        with _LOCK:
+            _EVENTS.append(event)
+
+    def count(self, **counts) -> None:
+        for key, value in counts.items():
+            self.args[key] = self.args.get(key, 0) + value
+
+
+def span(name: str, **counts):
+    if not _ENABLED:
+        return _NO_SPAN
+    return Span(name, counts)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    decorator form of `span`, named after the function unless told otherwise
+    """
+    def wrap(fn: Callable) -> Callable:
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not _ENABLED:
+                return fn(*args, **kwargs)
+            with Span(label, {}):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def enabled() -> bool:
+    return _ENABLED
+
+
+class SamplingProfiler:
+    """
+    samples the python stack of threads that are inside a profiled span.  spans
+    nest, so each thread keeps a stack of span names and the innermost profiled
+    one gets the sample
+    """
+
+    def __init__(self, spans: Iterable[str], interval_ms: float = 1.0):
+        self.spans = set(spans)
+        self.interval_s = interval_ms / 1000
+        self.active: Dict[int, List[str]] = defaultdict(list)
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rag-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def push(self, name: str) -> None:
+        self.active[threading.get_ident()].append(name)
+
+    def pop(self) -> None:
+        self.active[threading.get_ident()].pop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            frames = sys._current_frames()
+            for tid, names in list(self.active.items()):
+                profiled = [n for n in names if n in self.spans]
+                frame = frames.get(tid)
+                if not profiled or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join([profiled[-1]] + stack[::-1])] += 1
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, n in self.samples.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+def enable(path: Optional[str] = None, profile: Optional[Iterable[str]] = None, interval_ms: float = 1.0) -> None:
+    """
+    start recording.  with a `path` the trace (and summary) are written at exit
+    """
+    global _ENABLED, _PATH, _PROFILER
+    _ENABLED = True
+    _PATH = path
+    if profile:
+        _PROFILER = SamplingProfiler(profile, interval_ms)
+        _PROFILER.start()
+    if path:
+        atexit.register(finish)
+
+
+def summary() -> List[Dict]:
+    """
+    per span name: calls, total/mean/max ms, and the summed counts
+    """
+    by_name: Dict[str, Dict] = {}
+    with _LOCK:
+        events = list(_EVENTS)
+    for e in events:
+        row = by_name.setdefault(e["name"], {"name": e["name"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "counts": Counter()})
+        ms = e["dur"] / 1000
+        row["calls"] += 1
+        row["total_ms"] += ms
+        row["max_ms"] = max(row["max_ms"], ms)
+        row["counts"].update({k: v for k, v in e["args"].items() if isinstance(v, (int, float))})
+    rows = sorted(by_name.values(), key=lambda r: r["total_ms"], reverse=True)
+    for row in rows:
+        row["mean_ms"] = row["total_ms"] / row["calls"]
+    return rows
+
+
+def print_summary(file=sys.stderr) -> None:
+    print(f"{'stage':<20}{'calls':>7}{'total ms':>11}{'mean ms':>10}{'max ms':>10}  counts", file=file)
+    for row in summary():
+        counts = " ".join(f"{k}={v:g}" for k, v in row["counts"].items())
+        print(
+            f"{row['name']:<20}{row['calls']:>7}{row['total_ms']:>11.2f}{row['mean_ms']:>10.2f}{row['max_ms']:>10.2f}  {counts}",
+            file=file,
+        )
+
+
+def export(path: str) -> None:
+    with _LOCK:
+        events = list(_EVENTS)
+    names = {e["tid"] for e in events}
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": t.ident, "args": {"name": t.name}}
+        for t in threading.enumerate() if t.ident in names
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+
+
+def finish() -> None:
+    global _PROFILER
+    if _PROFILER is not None:
+        _PROFILER.stop()
+        if _PATH:
+            _PROFILER.write(os.path.splitext(_PATH)[0] + ".folded")
+        _PROFILER = None
+    if _PATH:
+        export(_PATH)
+        print(f"trace written to {_PATH}", file=sys.stderr)
+    print_summary()
+
+
+if os.environ.get("RAG_TRACE"):
+    enable(
+        os.environ["RAG_TRACE"],
+        [s for s in os.environ.get("RAG_PROFILE", "").split(",") if s],
+        float(os.environ.get("RAG_PROFILE_INTERVAL_MS", "1")),
+    )